@@ -123,7 +123,9 @@ async def change_password(
             detail="当前密码错误",
         )
     
-    current_user.hashed_password = get_password_hash(password_data.new_password)
+    # current_user may come from the principal cache: update the row through this session
+    user = await db.get(User, current_user.id)
+    user.hashed_password = get_password_hash(password_data.new_password)
     await db.commit()
     
     return MessageResponse(message="密码修改成功")
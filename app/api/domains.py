@@ -1,18 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
-from app.schemas import O365DomainResponse, MessageResponse
+from app.schemas import O365DomainResponse, MessageResponse, graph_fields
 from app.services.graph_service import GraphAPIService
 from app.api.o365_users import get_graph_service
 
 router = APIRouter(prefix="/api/o365/domains", tags=["O365 Domains"])
 
+DOMAIN_SELECT = graph_fields(O365DomainResponse)
+
 
 @router.get("", response_model=List[O365DomainResponse])
 async def list_domains(
     graph_service: GraphAPIService = Depends(get_graph_service)
 ):
     try:
-        domains = await graph_service.get_domains()
+        domains = await graph_service.get_domains(select=DOMAIN_SELECT)
         return [O365DomainResponse(**domain) for domain in domains]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -24,7 +26,7 @@ async def get_domain(
     graph_service: GraphAPIService = Depends(get_graph_service)
 ):
     try:
-        domain = await graph_service.get_domain(domain_id)
+        domain = await graph_service.get_domain(domain_id, select=DOMAIN_SELECT)
         return O365DomainResponse(**domain)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
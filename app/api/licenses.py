@@ -1,36 +1,80 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
-from typing import List
-import json
+from sqlalchemy import select
+from typing import List, Optional
+import asyncio
 import logging
-from pathlib import Path
-from datetime import datetime, timedelta
-from app.database import get_db
-from app.schemas import O365LicenseResponse
+from datetime import datetime
+from app.config import get_settings
+from app.database import get_db, AsyncSessionLocal
+from app.schemas import (
+    O365LicenseResponse, TenantLicenseSummary, LicenseRefreshQueueEntry, LicenseUsageTrend
+)
 from app.services.graph_service import GraphAPIService
-from app.api.o365_users import get_graph_service, get_graph_service_by_id
-from app.models import LicenseCache
+from app.services.circuit_breaker import CircuitOpenError, CREDENTIALS
+from app.services.tenant_registry import tenant_registry
+from app.services.license_cache import (
+    sku_to_license, cache_row_to_license, is_cache_stale, get_sku_name_cn,
+    read_cached_licenses, refresh_tenant_licenses
+)
+from app.services.license_history import usage_trends
+from app.services.license_refresher import license_refresher
+from app.api.o365_users import get_graph_service, get_active_tenant
+from app.models import LicenseCache, Tenant
 
 router = APIRouter(prefix="/api/o365/licenses", tags=["O365 Licenses"])
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
-# Cache expiry time in hours
-CACHE_EXPIRY_HOURS = 24
 
-# Load SKU mapping
-SKU_MAP_PATH = Path(__file__).parent.parent / "sku_map.json"
-try:
-    with open(SKU_MAP_PATH, "r", encoding="utf-8") as f:
-        SKU_MAP = json.load(f)
-except Exception as e:
-    print(f"Warning: Failed to load sku_map.json: {e}")
-    SKU_MAP = {}
-
-
-def get_sku_name_cn(sku_part_number: str) -> str:
-    """Get Chinese name for SKU, fallback to SKU part number if not found"""
-    return SKU_MAP.get(sku_part_number, sku_part_number)
+def license_error(tenant_id: int, e: Exception) -> HTTPException:
+    """Translate a license fetch failure into a helpful HTTP error"""
+    if isinstance(e, CircuitOpenError):
+        # Known-bad tenant: no need to pattern-match the original error again
+        return HTTPException(
+            status_code=401 if e.kind == CREDENTIALS else 503,
+            detail=f"租户 {tenant_id} 暂停访问至 {e.retry_at.strftime('%Y-%m-%d %H:%M:%S')} (UTC)，原因: {e.reason}"
+        )
+    
+    error_msg = str(e)
+    
+    # Provide more helpful error messages based on common issues
+    if "Insufficient privileges" in error_msg or "Access is denied" in error_msg:
+        return HTTPException(
+            status_code=403,
+            detail=f"租户 {tenant_id} 权限不足。请确保应用已被授予 Organization.Read.All 权限并且已授予管理员同意。"
+        )
+    elif "Invalid client secret" in error_msg or "AADSTS7000215" in error_msg:
+        return HTTPException(
+            status_code=401,
+            detail=f"租户 {tenant_id} 身份验证失败。客户端密钥无效或已过期，请检查租户凭据。"
+        )
+    elif "AADSTS700016" in error_msg:
+        return HTTPException(
+            status_code=401,
+            detail=f"租户 {tenant_id} 身份验证失败。应用程序 ID (Client ID) 不存在或未在该租户中注册。"
+        )
+    elif "AADSTS90002" in error_msg or "Tenant" in error_msg and "not found" in error_msg:
+        return HTTPException(
+            status_code=404,
+            detail=f"租户 {tenant_id} 的目录 ID (Tenant ID) 无效或该租户不存在。"
+        )
+    elif "timed out" in error_msg.lower():
+        return HTTPException(
+            status_code=504,
+            detail=f"获取租户 {tenant_id} 许可证超时。请检查网络连接或稍后重试。"
+        )
+    elif "Connection" in error_msg or "Network" in error_msg:
+        return HTTPException(
+            status_code=503,
+            detail=f"无法连接到 Microsoft Graph API。请检查网络连接。详细错误: {error_msg}"
+        )
+    else:
+        return HTTPException(
+            status_code=500,
+            detail=f"获取租户 {tenant_id} 许可证失败: {error_msg}"
+        )
 
 
 @router.get("", response_model=List[O365LicenseResponse])
@@ -40,29 +84,7 @@ async def list_licenses(
     try:
         logger.info("Fetching licenses for default tenant")
         skus = await graph_service.get_subscribed_skus()
-        
-        licenses = []
-        for sku in skus:
-            prepaid_units = sku.get("prepaidUnits", {})
-            sku_part_number = sku.get("skuPartNumber")
-            
-            # 尝试获取过期时间（如果存在）
-            expires_at = None
-            if "nextLifecycleDateTime" in sku and sku["nextLifecycleDateTime"]:
-                try:
-                    expires_at = datetime.fromisoformat(sku["nextLifecycleDateTime"].replace('Z', '+00:00'))
-                except Exception as e:
-                    logger.warning(f"Failed to parse nextLifecycleDateTime for {sku_part_number}: {e}")
-            
-            licenses.append(O365LicenseResponse(
-                sku_id=sku.get("skuId"),
-                sku_part_number=sku_part_number,
-                sku_name_cn=get_sku_name_cn(sku_part_number),
-                consumed_units=sku.get("consumedUnits", 0),
-                enabled_units=prepaid_units.get("enabled", 0),
-                available_units=prepaid_units.get("enabled", 0) - sku.get("consumedUnits", 0),
-                expires_at=expires_at
-            ))
+        licenses = [sku_to_license(sku) for sku in skus]
         
         logger.info(f"Successfully fetched {len(licenses)} licenses")
         return licenses
@@ -95,14 +117,140 @@ async def list_licenses(
             )
 
 
+def build_license_summary(
+    tenant: Tenant,
+    source: str,
+    licenses: List[O365LicenseResponse],
+    cached_at: Optional[datetime],
+    stale: bool = False
+) -> TenantLicenseSummary:
+    return TenantLicenseSummary(
+        tenant_id=tenant.id,
+        tenant_name=tenant.tenant_name,
+        source=source,
+        cached_at=cached_at,
+        total_enabled=sum(license.enabled_units for license in licenses),
+        total_consumed=sum(license.consumed_units for license in licenses),
+        licenses=licenses,
+        stale=stale
+    )
+
+
+@router.get("/tenants", response_model=List[TenantLicenseSummary])
+async def list_licenses_for_tenants(
+    tenant_ids: Optional[List[int]] = Query(None, description="Tenant IDs (default: all active tenants)"),
+    refresh: bool = Query(False, description="Force refresh every tenant from Microsoft Graph API"),
+    stream: bool = Query(False, description="Stream NDJSON, one tenant per line, as each one completes"),
+    db: AsyncSession = Depends(get_db)
+):
+    """License summaries for many tenants in one call
+    
+    Caches are read with a single query and served as-is, even when expired:
+    expired ones are flagged `stale` and revalidated in the background. Only
+    tenants with no cache at all are fetched from Microsoft Graph, concurrently
+    and within LICENSE_REFRESH_CONCURRENCY.
+    """
+    query = select(Tenant).where(Tenant.is_active == True).order_by(Tenant.id)
+    if tenant_ids:
+        query = query.where(Tenant.id.in_(tenant_ids))
+    result = await db.execute(query)
+    tenants = result.scalars().all()
+    
+    cached = {} if refresh else await read_cached_licenses(db, [tenant.id for tenant in tenants])
+    
+    ready: List[TenantLicenseSummary] = []
+    missing: List[Tenant] = []
+    for tenant in tenants:
+        rows = cached.get(tenant.id)
+        if not rows:
+            missing.append(tenant)
+            continue
+        cached_at = min((row.cached_at for row in rows if row.cached_at), default=None)
+        stale = is_cache_stale(tenant, cached_at)
+        if stale:
+            license_refresher.request(tenant)
+        ready.append(build_license_summary(
+            tenant, "cache", [cache_row_to_license(row) for row in rows], cached_at, stale
+        ))
+    
+    logger.info(f"Bulk licenses: {len(ready)} tenants from cache, {len(missing)} from Graph")
+    semaphore = asyncio.Semaphore(max(1, settings.license_refresh_concurrency))
+    
+    async def fetch(tenant: Tenant) -> TenantLicenseSummary:
+        async with semaphore:
+            try:
+                async with AsyncSessionLocal() as session:
+                    graph_service = tenant_registry.get_graph_service(tenant)
+                    licenses = await refresh_tenant_licenses(session, tenant.id, graph_service)
+                return build_license_summary(tenant, "graph", licenses, datetime.utcnow())
+            except Exception as e:
+                logger.warning(f"Bulk license refresh failed for tenant {tenant.id}: {e}")
+                return TenantLicenseSummary(
+                    tenant_id=tenant.id,
+                    tenant_name=tenant.tenant_name,
+                    source="error",
+                    error=license_error(tenant.id, e).detail
+                )
+    
+    if not stream:
+        fetched = await asyncio.gather(*(fetch(tenant) for tenant in missing))
+        summaries = {summary.tenant_id: summary for summary in [*ready, *fetched]}
+        return [summaries[tenant.id] for tenant in tenants]
+    
+    async def generate():
+        for summary in ready:
+            yield summary.model_dump_json() + "\n"
+        tasks = [asyncio.create_task(fetch(tenant)) for tenant in missing]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield (await next_done).model_dump_json() + "\n"
+        finally:
+            # Client went away: stop fetching for it
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@router.get("/refresh-queue", response_model=List[LicenseRefreshQueueEntry])
+async def get_refresh_queue(db: AsyncSession = Depends(get_db)):
+    """Background license refresher queue, soonest due first"""
+    entries = await license_refresher.load_queue(db)
+    return license_refresher.describe(entries)
+
+
+@router.get("/usage-history", response_model=List[LicenseUsageTrend])
+async def get_license_usage_history(
+    tenant_ids: Optional[List[int]] = Query(None, description="Tenant IDs (default: all tenants)"),
+    sku_id: Optional[str] = None,
+    days: int = Query(30, ge=1, le=730),
+    include_points: bool = True,
+    db: AsyncSession = Depends(get_db)
+):
+    """Consumption trend per tenant and SKU with burn rate and projected exhaustion
+    
+    Served from the stored usage history (never calls Graph). burn_rate_per_day
+    is the least-squares slope of consumed units over the window.
+    """
+    trends = await usage_trends(db, days, tenant_ids, sku_id, include_points)
+    for trend in trends:
+        trend.sku_name_cn = get_sku_name_cn(trend.sku_part_number)
+    return trends
+
+
 @router.get("/tenant/{tenant_id}", response_model=List[O365LicenseResponse])
 async def list_licenses_by_tenant(
     tenant_id: int,
+    response: Response,
     refresh: bool = Query(False, description="Force refresh from Microsoft Graph API"),
     db: AsyncSession = Depends(get_db)
 ):
     """Get licenses for a specific tenant by ID
     
+    The cache is served even when expired (stale-while-revalidate): the
+    response then carries `X-Cache-Stale: true` and a background refresh is
+    queued. Graph is only called inline when there is no cache yet.
+    
     Args:
         tenant_id: The tenant ID
         refresh: If True, force refresh from Microsoft Graph API and update cache
@@ -110,140 +258,40 @@ async def list_licenses_by_tenant(
     """
     try:
         logger.info(f"Fetching licenses for tenant ID: {tenant_id}, refresh={refresh}")
+        tenant = await get_active_tenant(db, tenant_id)
         
         # Check if we should use cache
         if not refresh:
             # Try to get from cache
-            cache_expiry = datetime.utcnow() - timedelta(hours=CACHE_EXPIRY_HOURS)
             result = await db.execute(
-                select(LicenseCache)
-                .where(LicenseCache.tenant_id == tenant_id)
-                .where(LicenseCache.cached_at > cache_expiry)
+                select(LicenseCache).where(LicenseCache.tenant_id == tenant_id)
             )
             cached_licenses = result.scalars().all()
             
             if cached_licenses:
-                logger.info(f"Using cached licenses for tenant {tenant_id}, {len(cached_licenses)} licenses found")
-                licenses = []
-                for cache in cached_licenses:
-                    licenses.append(O365LicenseResponse(
-                        sku_id=cache.sku_id,
-                        sku_part_number=cache.sku_part_number,
-                        sku_name_cn=cache.sku_name_cn,
-                        consumed_units=cache.consumed_units,
-                        enabled_units=cache.enabled_units,
-                        available_units=cache.available_units,
-                        expires_at=cache.expires_at
-                    ))
-                return licenses
+                cached_at = min((cache.cached_at for cache in cached_licenses if cache.cached_at), default=None)
+                stale = is_cache_stale(tenant, cached_at)
+                if stale:
+                    license_refresher.request(tenant)
+                response.headers["X-Cache-Stale"] = "true" if stale else "false"
+                if cached_at:
+                    response.headers["X-Cached-At"] = cached_at.isoformat() + "Z"
+                logger.info(f"Using cached licenses for tenant {tenant_id}, {len(cached_licenses)} licenses found, stale={stale}")
+                return [cache_row_to_license(cache) for cache in cached_licenses]
         
         # Cache miss or force refresh - fetch from Microsoft Graph API
         logger.info(f"Cache miss or force refresh for tenant {tenant_id}, fetching from Microsoft Graph API")
         
         # Get graph service for the specific tenant
-        graph_service = await get_graph_service_by_id(tenant_id, db)
-        
-        # Fetch subscribed SKUs
-        logger.debug(f"Calling Microsoft Graph API for tenant {tenant_id}")
-        skus = await graph_service.get_subscribed_skus()
-        logger.debug(f"Received {len(skus)} SKUs from Graph API")
-        
-        # Clear old cache for this tenant
-        await db.execute(
-            delete(LicenseCache).where(LicenseCache.tenant_id == tenant_id)
-        )
-        
-        # Build licenses and save to cache
-        licenses = []
-        current_time = datetime.utcnow()
-        
-        for sku in skus:
-            prepaid_units = sku.get("prepaidUnits", {})
-            sku_part_number = sku.get("skuPartNumber")
-            sku_id = sku.get("skuId")
-            consumed_units = sku.get("consumedUnits", 0)
-            enabled_units = prepaid_units.get("enabled", 0)
-            available_units = enabled_units - consumed_units
-            sku_name_cn = get_sku_name_cn(sku_part_number)
-            
-            # 尝试获取过期时间（如果存在）
-            expires_at = None
-            if "nextLifecycleDateTime" in sku and sku["nextLifecycleDateTime"]:
-                try:
-                    expires_at = datetime.fromisoformat(sku["nextLifecycleDateTime"].replace('Z', '+00:00'))
-                except Exception as e:
-                    logger.warning(f"Failed to parse nextLifecycleDateTime for {sku_part_number}: {e}")
-            
-            # Add to response
-            licenses.append(O365LicenseResponse(
-                sku_id=sku_id,
-                sku_part_number=sku_part_number,
-                sku_name_cn=sku_name_cn,
-                consumed_units=consumed_units,
-                enabled_units=enabled_units,
-                available_units=available_units,
-                expires_at=expires_at
-            ))
-            
-            # Save to cache
-            cache_entry = LicenseCache(
-                tenant_id=tenant_id,
-                sku_id=sku_id,
-                sku_part_number=sku_part_number,
-                sku_name_cn=sku_name_cn,
-                consumed_units=consumed_units,
-                enabled_units=enabled_units,
-                available_units=available_units,
-                expires_at=expires_at,
-                cached_at=current_time
-            )
-            db.add(cache_entry)
-        
-        await db.commit()
+        graph_service = tenant_registry.get_graph_service(tenant)
+        licenses = await refresh_tenant_licenses(db, tenant_id, graph_service)
         
         logger.info(f"Successfully fetched and cached {len(licenses)} licenses for tenant {tenant_id}")
         return licenses
     except HTTPException as he:
-        # Re-raise HTTPExceptions from get_graph_service_by_id
+        # Re-raise HTTPExceptions from get_active_tenant
         logger.warning(f"HTTP error for tenant {tenant_id}: {he.detail}")
         raise
     except Exception as e:
         logger.error(f"Error fetching licenses for tenant {tenant_id}: {str(e)}", exc_info=True)
-        error_msg = str(e)
-        
-        # Provide more helpful error messages based on common issues
-        if "Insufficient privileges" in error_msg or "Access is denied" in error_msg:
-            raise HTTPException(
-                status_code=403,
-                detail=f"租户 {tenant_id} 权限不足。请确保应用已被授予 Organization.Read.All 权限并且已授予管理员同意。"
-            )
-        elif "Invalid client secret" in error_msg or "AADSTS7000215" in error_msg:
-            raise HTTPException(
-                status_code=401,
-                detail=f"租户 {tenant_id} 身份验证失败。客户端密钥无效或已过期，请检查租户凭据。"
-            )
-        elif "AADSTS700016" in error_msg:
-            raise HTTPException(
-                status_code=401,
-                detail=f"租户 {tenant_id} 身份验证失败。应用程序 ID (Client ID) 不存在或未在该租户中注册。"
-            )
-        elif "AADSTS90002" in error_msg or "Tenant" in error_msg and "not found" in error_msg:
-            raise HTTPException(
-                status_code=404,
-                detail=f"租户 {tenant_id} 的目录 ID (Tenant ID) 无效或该租户不存在。"
-            )
-        elif "timed out" in error_msg.lower():
-            raise HTTPException(
-                status_code=504,
-                detail=f"获取租户 {tenant_id} 许可证超时。请检查网络连接或稍后重试。"
-            )
-        elif "Connection" in error_msg or "Network" in error_msg:
-            raise HTTPException(
-                status_code=503,
-                detail=f"无法连接到 Microsoft Graph API。请检查网络连接。详细错误: {error_msg}"
-            )
-        else:
-            raise HTTPException(
-                status_code=500,
-                detail=f"获取租户 {tenant_id} 许可证失败: {error_msg}"
-            )
+        raise license_error(tenant_id, e)
@@ -1,20 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func, or_
 from typing import List, Optional
+import asyncio
+from app.config import get_settings
 from app.database import get_db
-from app.models import Tenant
+from app.models import Tenant, DirectoryUser, DirectorySyncState
 from app.schemas import (
-    O365UserCreate, O365UserUpdate, O365UserResponse, MessageResponse
+    O365UserCreate, O365UserUpdate, O365UserResponse, MessageResponse,
+    DirectorySyncStatusResponse, DirectorySyncResult, DirectoryUserCountResponse,
+    CrossTenantUserMatch, UserCountStats, FleetUserCountStats, graph_fields
 )
-from app.services.msal_service import MSALService
 from app.services.graph_service import GraphAPIService
+from app.services.tenant_registry import tenant_registry
+from app.services.directory_mirror import sync_tenant_users, mirror_user_changes, MIRROR_SELECT
+from app.services.user_search import iter_user_search
 
 router = APIRouter(prefix="/api/o365/users", tags=["O365 Users"])
+settings = get_settings()
 
+USER_SELECT = graph_fields(O365UserResponse)
 
-async def get_graph_service_by_id(tenant_id: int, db: AsyncSession) -> GraphAPIService:
-    """Get GraphAPIService for a specific tenant by ID"""
+
+async def get_active_tenant(db: AsyncSession, tenant_id: Optional[int] = None) -> Tenant:
+    """Get a tenant by ID, or the first active tenant when no ID is given"""
+    if tenant_id is None:
+        result = await db.execute(
+            select(Tenant).where(Tenant.is_active == True).limit(1)
+        )
+        tenant = result.scalar_one_or_none()
+        if not tenant:
+            raise HTTPException(
+                status_code=400,
+                detail="No active tenant found. Please add a tenant first."
+            )
+        return tenant
+    
     result = await db.execute(
         select(Tenant).where(Tenant.id == tenant_id)
     )
@@ -32,93 +54,280 @@ async def get_graph_service_by_id(tenant_id: int, db: AsyncSession) -> GraphAPIS
             detail="Tenant is not active."
         )
     
-    msal_service = MSALService(
-        tenant_id=tenant.tenant_id,
-        client_id=tenant.client_id,
-        client_secret=tenant.client_secret
-    )
-    
-    return GraphAPIService(msal_service)
+    return tenant
+
+
+async def get_graph_service_by_id(tenant_id: int, db: AsyncSession) -> GraphAPIService:
+    """Get GraphAPIService for a specific tenant by ID"""
+    tenant = await get_active_tenant(db, tenant_id)
+    return tenant_registry.get_graph_service(tenant)
 
 
 async def get_graph_service(db: AsyncSession = Depends(get_db)) -> GraphAPIService:
     """Legacy function - get first active tenant for backward compatibility"""
-    result = await db.execute(
-        select(Tenant).where(Tenant.is_active == True).limit(1)
-    )
-    tenant = result.scalar_one_or_none()
-    
-    if not tenant:
-        raise HTTPException(
-            status_code=400,
-            detail="No active tenant found. Please add a tenant first."
-        )
-    
-    msal_service = MSALService(
-        tenant_id=tenant.tenant_id,
-        client_id=tenant.client_id,
-        client_secret=tenant.client_secret
+    tenant = await get_active_tenant(db)
+    return tenant_registry.get_graph_service(tenant)
+
+
+def mirror_user_to_response(row: DirectoryUser) -> O365UserResponse:
+    return O365UserResponse(
+        id=row.object_id,
+        display_name=row.display_name or "",
+        user_principal_name=row.user_principal_name or "",
+        mail=row.mail,
+        account_enabled=bool(row.account_enabled),
+        usage_location=row.usage_location,
+        created_datetime=row.created_datetime
     )
-    
-    return GraphAPIService(msal_service)
 
 
 @router.get("", response_model=List[O365UserResponse])
 async def list_users(
     top: int = 100,
     filter_query: Optional[str] = None,
-    graph_service: GraphAPIService = Depends(get_graph_service)
+    tenant_id: Optional[int] = None,
+    skip: int = 0,
+    keyword: Optional[str] = Query(None, description="Match display name / UPN / mail (mirror only)"),
+    account_enabled: Optional[bool] = None,
+    live: bool = Query(False, description="Bypass the local mirror and query Microsoft Graph"),
+    db: AsyncSession = Depends(get_db)
 ):
+    """
+    List users. Served from the local directory mirror once the tenant has been
+    synced; OData filter_query or live=true always go to Microsoft Graph.
+    """
+    tenant = await get_active_tenant(db, tenant_id)
+    
+    if not live and not filter_query:
+        state = await db.get(DirectorySyncState, tenant.id)
+        if state is not None and state.last_synced_at is not None:
+            query = select(DirectoryUser).where(DirectoryUser.tenant_id == tenant.id)
+            if keyword:
+                pattern = f"%{keyword}%"
+                query = query.where(or_(
+                    DirectoryUser.display_name.ilike(pattern),
+                    DirectoryUser.user_principal_name.ilike(pattern),
+                    DirectoryUser.mail.ilike(pattern)
+                ))
+            if account_enabled is not None:
+                query = query.where(DirectoryUser.account_enabled == account_enabled)
+            query = query.order_by(DirectoryUser.display_name).offset(skip).limit(top)
+            
+            result = await db.execute(query)
+            return [mirror_user_to_response(row) for row in result.scalars().all()]
+    
     try:
-        users = await graph_service.get_users(filter_query=filter_query, top=top)
+        graph_service = tenant_registry.get_graph_service(tenant)
+        users = await graph_service.get_users(filter_query=filter_query, top=top, select=USER_SELECT)
         return [O365UserResponse(**user) for user in users]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/sync", response_model=DirectorySyncResult)
+async def sync_users(
+    tenant_id: Optional[int] = None,
+    full: bool = Query(False, description="Discard the delta token and resync the whole directory"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Sync the local users mirror with Microsoft Graph now"""
+    tenant = await get_active_tenant(db, tenant_id)
+    try:
+        return DirectorySyncResult(**await sync_tenant_users(tenant, full=full))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"目录同步失败: {str(e)}")
+
+
+@router.get("/sync-status", response_model=List[DirectorySyncStatusResponse])
+async def get_sync_status(
+    db: AsyncSession = Depends(get_db)
+):
+    result = await db.execute(select(DirectorySyncState).order_by(DirectorySyncState.tenant_id))
+    return [DirectorySyncStatusResponse.model_validate(state) for state in result.scalars().all()]
+
+
+@router.get("/count", response_model=DirectoryUserCountResponse)
+async def count_users(
+    tenant_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """User counts from the local directory mirror"""
+    tenant = await get_active_tenant(db, tenant_id)
+    state = await db.get(DirectorySyncState, tenant.id)
+    if state is None or state.last_synced_at is None:
+        raise HTTPException(status_code=409, detail="Tenant directory has not been synced yet.")
+    
+    result = await db.execute(
+        select(
+            func.count(DirectoryUser.id),
+            func.count(DirectoryUser.id).filter(DirectoryUser.account_enabled == True),
+            func.count(DirectoryUser.id).filter(DirectoryUser.account_enabled == False),
+            func.count(DirectoryUser.id).filter(DirectoryUser.user_type == "Guest")
+        ).where(DirectoryUser.tenant_id == tenant.id)
+    )
+    total, enabled, disabled, guests = result.one()
+    
+    return DirectoryUserCountResponse(
+        tenant_id=tenant.id,
+        total=total,
+        enabled=enabled,
+        disabled=disabled,
+        guests=guests,
+        synced_at=state.last_synced_at
+    )
+
+
+async def tenant_user_counts(tenant: Tenant) -> UserCountStats:
+    try:
+        graph_service = tenant_registry.get_graph_service(tenant)
+        counts = await graph_service.get_user_counts()
+        return UserCountStats(tenant_id=tenant.id, tenant_name=tenant.tenant_name, **counts)
+    except Exception as e:
+        return UserCountStats(tenant_id=tenant.id, tenant_name=tenant.tenant_name, error=str(e))
+
+
+@router.get("/stats", response_model=UserCountStats)
+async def get_user_stats(
+    tenant_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Live user counts from Microsoft Graph via $count (no listing)"""
+    tenant = await get_active_tenant(db, tenant_id)
+    stats = await tenant_user_counts(tenant)
+    if stats.error:
+        raise HTTPException(status_code=500, detail=f"获取用户统计失败: {stats.error}")
+    return stats
+
+
+@router.get("/stats/all", response_model=FleetUserCountStats)
+async def get_fleet_user_stats(
+    db: AsyncSession = Depends(get_db)
+):
+    """Live user counts for every active tenant, fetched concurrently"""
+    result = await db.execute(select(Tenant).where(Tenant.is_active == True).order_by(Tenant.id))
+    tenants = result.scalars().all()
+    semaphore = asyncio.Semaphore(max(1, settings.user_stats_concurrency))
+    
+    async def run(tenant: Tenant) -> UserCountStats:
+        async with semaphore:
+            return await tenant_user_counts(tenant)
+    
+    items = await asyncio.gather(*(run(tenant) for tenant in tenants))
+    ok = [item for item in items if item.error is None]
+    return FleetUserCountStats(
+        tenants=len(items),
+        failed=len(items) - len(ok),
+        total=sum(item.total for item in ok),
+        enabled=sum(item.enabled for item in ok),
+        disabled=sum(item.disabled for item in ok),
+        guests=sum(item.guests for item in ok),
+        items=items
+    )
+
+
 @router.get("/search", response_model=List[O365UserResponse])
 async def search_users(
     keyword: str,
     graph_service: GraphAPIService = Depends(get_graph_service)
 ):
     try:
-        users = await graph_service.search_users(keyword)
+        users = await graph_service.search_users(keyword, select=USER_SELECT)
         return [O365UserResponse(**user) for user in users]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/search-all", response_model=List[CrossTenantUserMatch])
+async def search_users_all_tenants(
+    keyword: str,
+    tenant_ids: Optional[List[int]] = Query(None, description="Tenant IDs (default: all active tenants)"),
+    limit: int = Query(50, ge=1, le=999, description="Stop once this many users have been found"),
+    stream: bool = Query(False, description="Stream NDJSON, one match per line, as each tenant answers"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Search users across tenants
+    
+    Every tenant is searched concurrently with its own timeout
+    (USER_SEARCH_TENANT_TIMEOUT); tenants that fail or time out produce a
+    single entry with `error` set. Remaining searches are cancelled as soon
+    as `limit` users have been found.
+    """
+    query = select(Tenant).where(Tenant.is_active == True).order_by(Tenant.id)
+    if tenant_ids:
+        query = query.where(Tenant.id.in_(tenant_ids))
+    result = await db.execute(query)
+    tenants = result.scalars().all()
+    
+    async def matches():
+        async for found in iter_user_search(tenants, keyword, select=USER_SELECT, limit=limit):
+            tenant = found["tenant"]
+            if found["error"]:
+                yield CrossTenantUserMatch(tenant_id=tenant.id, tenant_name=tenant.tenant_name, error=found["error"])
+            for user in found["users"]:
+                yield CrossTenantUserMatch(
+                    tenant_id=tenant.id, tenant_name=tenant.tenant_name, user=O365UserResponse(**user)
+                )
+    
+    if not stream:
+        return [match async for match in matches()]
+    
+    async def generate():
+        async for match in matches():
+            yield match.model_dump_json() + "\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 @router.get("/{user_id}", response_model=O365UserResponse)
 async def get_user(
     user_id: str,
     graph_service: GraphAPIService = Depends(get_graph_service)
 ):
     try:
-        user = await graph_service.get_user(user_id)
+        user = await graph_service.get_user(user_id, select=USER_SELECT)
         return O365UserResponse(**user)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def get_default_tenant(db: AsyncSession = Depends(get_db)) -> Tenant:
+    """First active tenant (the write routes below have no tenant_id yet)"""
+    return await get_active_tenant(db)
+
+
+def user_create_payload(user_data: O365UserCreate) -> dict:
+    return {
+        "accountEnabled": user_data.account_enabled,
+        "displayName": user_data.display_name,
+        "mailNickname": user_data.mail_nickname,
+        "userPrincipalName": user_data.user_principal_name,
+        "passwordProfile": {
+            "forceChangePasswordNextSignIn": user_data.force_change_password,
+            "password": user_data.password
+        },
+        "usageLocation": user_data.usage_location
+    }
+
+
+async def refresh_mirrored_user(tenant: Tenant, graph_service: GraphAPIService, user_id: str) -> O365UserResponse:
+    """Re-read a user after a PATCH (which returns no body) and update the mirror with it"""
+    user = await graph_service.get_user(user_id, select=MIRROR_SELECT)
+    await mirror_user_changes(tenant.id, [user])
+    return O365UserResponse(**user)
+
+
 @router.post("", response_model=O365UserResponse, status_code=status.HTTP_201_CREATED)
 async def create_user(
     user_data: O365UserCreate,
-    graph_service: GraphAPIService = Depends(get_graph_service)
+    tenant: Tenant = Depends(get_default_tenant)
 ):
     try:
-        user_payload = {
-            "accountEnabled": user_data.account_enabled,
-            "displayName": user_data.display_name,
-            "mailNickname": user_data.mail_nickname,
-            "userPrincipalName": user_data.user_principal_name,
-            "passwordProfile": {
-                "forceChangePasswordNextSignIn": user_data.force_change_password,
-                "password": user_data.password
-            },
-            "usageLocation": user_data.usage_location
-        }
-        
-        user = await graph_service.create_user(user_payload)
+        graph_service = tenant_registry.get_graph_service(tenant)
+        user_payload = user_create_payload(user_data)
+        created = await graph_service.create_user(user_payload)
+        # The POST response omits accountEnabled / usageLocation: take them from the request
+        user = {**user_payload, **created}
+        await mirror_user_changes(tenant.id, [user])
         return O365UserResponse(**user)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -127,24 +336,17 @@ async def create_user(
 @router.post("/batch", response_model=List[dict])
 async def batch_create_users(
     users_data: List[O365UserCreate],
-    graph_service: GraphAPIService = Depends(get_graph_service)
+    tenant: Tenant = Depends(get_default_tenant)
 ):
     try:
-        users_payload = []
-        for user_data in users_data:
-            users_payload.append({
-                "accountEnabled": user_data.account_enabled,
-                "displayName": user_data.display_name,
-                "mailNickname": user_data.mail_nickname,
-                "userPrincipalName": user_data.user_principal_name,
-                "passwordProfile": {
-                    "forceChangePasswordNextSignIn": user_data.force_change_password,
-                    "password": user_data.password
-                },
-                "usageLocation": user_data.usage_location
-            })
-        
+        graph_service = tenant_registry.get_graph_service(tenant)
+        users_payload = [user_create_payload(user_data) for user_data in users_data]
         results = await graph_service.batch_create_users(users_payload)
+        await mirror_user_changes(tenant.id, [
+            {**user_payload, **result["data"]}
+            for user_payload, result in zip(users_payload, results)
+            if result["success"] and isinstance(result.get("data"), dict)
+        ])
         return results
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -154,12 +356,13 @@ async def batch_create_users(
 async def update_user(
     user_id: str,
     user_data: O365UserUpdate,
-    graph_service: GraphAPIService = Depends(get_graph_service)
+    tenant: Tenant = Depends(get_default_tenant)
 ):
     try:
+        graph_service = tenant_registry.get_graph_service(tenant)
         update_payload = user_data.model_dump(exclude_unset=True)
-        user = await graph_service.update_user(user_id, update_payload)
-        return O365UserResponse(**user)
+        await graph_service.update_user(user_id, update_payload)
+        return await refresh_mirrored_user(tenant, graph_service, user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -167,10 +370,12 @@ async def update_user(
 @router.delete("/{user_id}", response_model=MessageResponse)
 async def delete_user(
     user_id: str,
-    graph_service: GraphAPIService = Depends(get_graph_service)
+    tenant: Tenant = Depends(get_default_tenant)
 ):
     try:
+        graph_service = tenant_registry.get_graph_service(tenant)
         await graph_service.delete_user(user_id)
+        await mirror_user_changes(tenant.id, removed=[user_id])
         return MessageResponse(message="User deleted successfully")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -179,11 +384,12 @@ async def delete_user(
 @router.post("/{user_id}/enable", response_model=O365UserResponse)
 async def enable_user(
     user_id: str,
-    graph_service: GraphAPIService = Depends(get_graph_service)
+    tenant: Tenant = Depends(get_default_tenant)
 ):
     try:
-        user = await graph_service.enable_user(user_id)
-        return O365UserResponse(**user)
+        graph_service = tenant_registry.get_graph_service(tenant)
+        await graph_service.enable_user(user_id)
+        return await refresh_mirrored_user(tenant, graph_service, user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -191,10 +397,11 @@ async def enable_user(
 @router.post("/{user_id}/disable", response_model=O365UserResponse)
 async def disable_user(
     user_id: str,
-    graph_service: GraphAPIService = Depends(get_graph_service)
+    tenant: Tenant = Depends(get_default_tenant)
 ):
     try:
-        user = await graph_service.disable_user(user_id)
-        return O365UserResponse(**user)
+        graph_service = tenant_registry.get_graph_service(tenant)
+        await graph_service.disable_user(user_id)
+        return await refresh_mirrored_user(tenant, graph_service, user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,10 +1,74 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
+import json
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db
+from app.schemas import FleetDashboardResponse, TenantSnapshotResponse, SnapshotRunResult
 from app.services.graph_service import GraphAPIService
+from app.services.scheduler import scheduler
+from app.services.tenant_snapshot import latest_snapshots, snapshot_all_tenants
 from app.api.o365_users import get_graph_service
 
 router = APIRouter(prefix="/api/o365/reports", tags=["O365 Reports"])
 
 
+def stream_csv(graph_service: GraphAPIService, upstream, filename: str) -> StreamingResponse:
+    """Pass a Graph report download through to the client chunk by chunk"""
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    # aiohttp transparently decompresses, so only a plain body's length is still accurate
+    if upstream.content_length is not None and "Content-Encoding" not in upstream.headers:
+        headers["Content-Length"] = str(upstream.content_length)
+    return StreamingResponse(
+        graph_service.iter_content(upstream),
+        media_type="text/csv",
+        headers=headers,
+        # Runs even if the client disconnects before the body is iterated
+        background=BackgroundTask(graph_service.release_content, upstream)
+    )
+
+
+@router.get("/dashboard", response_model=FleetDashboardResponse)
+async def get_fleet_dashboard(db: AsyncSession = Depends(get_db)):
+    """Fleet overview from the latest stored snapshot per tenant (never calls Graph)"""
+    items = []
+    for tenant, report in await latest_snapshots(db):
+        item = TenantSnapshotResponse(
+            tenant_id=tenant.id,
+            tenant_name=tenant.tenant_name,
+            is_active=bool(tenant.is_active)
+        )
+        if report is not None:
+            item.snapshot_at = report.created_at
+            item.total_users = report.total_users
+            item.total_admins = report.total_admins
+            item.spo_available = report.spo_available
+            item.report_data = json.loads(report.report_data) if report.report_data else {}
+        items.append(item)
+    
+    snapshotted = [item for item in items if item.snapshot_at is not None]
+    return FleetDashboardResponse(
+        tenants=len(items),
+        snapshotted=len(snapshotted),
+        total_users=sum(item.total_users or 0 for item in snapshotted),
+        total_admins=sum(item.total_admins or 0 for item in snapshotted),
+        spo_available=sum(1 for item in snapshotted if item.spo_available),
+        oldest_snapshot_at=min((item.snapshot_at for item in snapshotted), default=None),
+        items=items
+    )
+
+
+@router.post("/snapshots", response_model=SnapshotRunResult)
+async def run_tenant_snapshots():
+    """Take a snapshot of every active tenant now"""
+    job = scheduler.get("tenant_snapshot")
+    try:
+        result = await job.run_now() if job is not None else await snapshot_all_tenants()
+        return SnapshotRunResult(**result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"租户快照失败: {str(e)}")
+
+
 @router.get("/organization")
 async def get_organization_info(
     graph_service: GraphAPIService = Depends(get_graph_service)
@@ -22,16 +86,11 @@ async def get_onedrive_usage_report(
     graph_service: GraphAPIService = Depends(get_graph_service)
 ):
     try:
-        report_data = await graph_service.get_onedrive_usage_report(period)
-        return Response(
-            content=report_data,
-            media_type="text/csv",
-            headers={
-                "Content-Disposition": f"attachment; filename=onedrive_usage_{period}.csv"
-            }
-        )
+        upstream = await graph_service.open_onedrive_usage_report(period)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    return stream_csv(graph_service, upstream, f"onedrive_usage_{period}.csv")
 
 
 @router.get("/exchange")
@@ -40,13 +99,8 @@ async def get_exchange_usage_report(
     graph_service: GraphAPIService = Depends(get_graph_service)
 ):
     try:
-        report_data = await graph_service.get_exchange_usage_report(period)
-        return Response(
-            content=report_data,
-            media_type="text/csv",
-            headers={
-                "Content-Disposition": f"attachment; filename=exchange_usage_{period}.csv"
-            }
-        )
+        upstream = await graph_service.open_exchange_usage_report(period)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    return stream_csv(graph_service, upstream, f"exchange_usage_{period}.csv")
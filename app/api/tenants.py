@@ -1,40 +1,208 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete
-from typing import List
-from datetime import datetime
+from sqlalchemy import select, update, delete, func, or_, and_
+from typing import List, Optional, Tuple
+import asyncio
+import base64
+import json
+from datetime import datetime, timedelta
 from app.database import get_db
-from app.models import Tenant
+from app.models import Tenant, TenantReport, DirectoryUser, DirectorySyncState, LicenseUsageSample
 from app.schemas import (
     TenantCreate, TenantUpdate, TenantResponse, 
-    TenantListResponse, MessageResponse, SpoStatusResponse
+    TenantListResponse, MessageResponse, SpoStatusResponse, GraphRequestStatsResponse,
+    CredentialCheckResult, SpoSweepResult, TokenWarmupStatus, CircuitBreakerStatus,
+    SecretRotationRequest, SecretRotationStatus
 )
-from app.services.msal_service import MSALService
-from app.services.graph_service import GraphAPIService
+from app.services.tenant_registry import tenant_registry
+from app.services.retry_policy import request_stats
+from app.services.throttle import tenant_limiters
+from app.services.tenant_health import iter_credential_checks, sweep_spo_status
+from app.services.scheduler import scheduler
+from app.services.token_warmer import token_warmer
+from app.services.circuit_breaker import circuit_breakers, CircuitOpenError
+from app.services.secret_rotation import secret_rotation
 
 router = APIRouter(prefix="/api/tenants", tags=["Tenants"])
 
 
+def encode_cursor(tenant: Tenant) -> str:
+    payload = json.dumps([tenant.created_at.isoformat(), tenant.id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="无效的分页游标")
+
+
 @router.get("", response_model=TenantListResponse)
 async def list_tenants(
-    skip: int = 0,
-    limit: int = 100,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page (replaces skip)"),
+    is_active: Optional[bool] = None,
+    credential_status: Optional[str] = Query(None, description="valid / invalid"),
+    spo_status: Optional[str] = None,
+    secret_expires_within_days: Optional[int] = Query(
+        None, ge=0, description="Only tenants whose secret expires within N days (including expired)"
+    ),
     db: AsyncSession = Depends(get_db)
 ):
-    result = await db.execute(
-        select(Tenant).offset(skip).limit(limit).order_by(Tenant.created_at.desc())
-    )
+    """List tenants, newest first
+    
+    Paging is keyset based: pass the returned next_cursor to get the next
+    page. skip still works for the first pages but costs O(skip).
+    """
+    filters = []
+    if is_active is not None:
+        filters.append(Tenant.is_active == is_active)
+    if credential_status:
+        filters.append(Tenant.credential_status == credential_status)
+    if spo_status:
+        filters.append(Tenant.spo_status == spo_status)
+    if secret_expires_within_days is not None:
+        cutoff = datetime.utcnow() + timedelta(days=secret_expires_within_days)
+        filters.append(Tenant.client_secret_expires_at <= cutoff)
+    
+    query = select(Tenant).where(*filters).order_by(Tenant.created_at.desc(), Tenant.id.desc()).limit(limit)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.where(or_(
+            Tenant.created_at < created_at,
+            and_(Tenant.created_at == created_at, Tenant.id < row_id)
+        ))
+    elif skip:
+        query = query.offset(skip)
+    result = await db.execute(query)
     tenants = result.scalars().all()
     
-    count_result = await db.execute(select(Tenant))
-    total = len(count_result.scalars().all())
+    total = await db.scalar(select(func.count()).select_from(Tenant).where(*filters))
     
     return TenantListResponse(
         total=total,
-        items=[TenantResponse.model_validate(t) for t in tenants]
+        items=[TenantResponse.model_validate(t) for t in tenants],
+        next_cursor=encode_cursor(tenants[-1]) if len(tenants) == limit else None
     )
 
 
+@router.get("/graph-stats", response_model=List[GraphRequestStatsResponse])
+async def get_graph_request_stats():
+    """Per-tenant Graph retry / throttling counters since process start"""
+    items = []
+    for stats in request_stats.snapshot():
+        limiter = tenant_limiters.peek(stats["tenant_id"])
+        if limiter is not None:
+            stats["concurrency_limit"] = round(limiter.limit, 2)
+            stats["in_flight"] = limiter.in_flight
+        items.append(GraphRequestStatsResponse(**stats))
+    return items
+
+
+def sse_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+@router.get("/validate-all")
+async def validate_all_tenants(
+    tenant_ids: Optional[List[int]] = Query(None, description="Tenant IDs (default: all active tenants)"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Validate credentials for many tenants concurrently
+    
+    Streams Server-Sent Events: one `result` event per tenant as soon as its
+    check completes, then a `done` event with the totals. Checks run within
+    CREDENTIAL_CHECK_CONCURRENCY and statuses are saved in batches.
+    """
+    query = select(Tenant).where(Tenant.is_active == True).order_by(Tenant.id)
+    if tenant_ids:
+        query = query.where(Tenant.id.in_(tenant_ids))
+    result = await db.execute(query)
+    tenants = result.scalars().all()
+    
+    async def generate():
+        valid = invalid = 0
+        async for check in iter_credential_checks(tenants):
+            if check["valid"]:
+                valid += 1
+            else:
+                invalid += 1
+            yield sse_event("result", CredentialCheckResult(**check).model_dump_json())
+        yield sse_event("done", json.dumps({"total": len(tenants), "valid": valid, "invalid": invalid}))
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/spo-sweep", response_model=SpoSweepResult)
+async def run_spo_sweep(
+    tenant_ids: Optional[List[int]] = Query(None, description="Tenant IDs (default: all active tenants)")
+):
+    """Check SharePoint Online status for all tenants now"""
+    job = scheduler.get("spo_sweep")
+    try:
+        if job is not None and not tenant_ids:
+            # Shares the scheduled job's lock, so a manual sweep never overlaps a scheduled one
+            return SpoSweepResult(**await job.run_now())
+        return SpoSweepResult(**await sweep_spo_status(tenant_ids))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"SharePoint 状态巡检失败: {str(e)}")
+
+
+@router.post("/rotate-secrets", response_model=SecretRotationStatus, status_code=status.HTTP_202_ACCEPTED)
+async def start_secret_rotation(request: SecretRotationRequest):
+    """Rotate client secrets for all tenants expiring soon, as a background job"""
+    if secret_rotation.running:
+        raise HTTPException(status_code=409, detail="密钥轮换任务正在进行中")
+    
+    tenants = await secret_rotation.select_tenants(
+        request.expires_within_days,
+        tenant_ids=request.tenant_ids,
+        include_unknown_expiry=request.include_unknown_expiry
+    )
+    if not tenants:
+        raise HTTPException(status_code=400, detail="没有需要轮换密钥的租户")
+    
+    secret_rotation.start(tenants, delete_old_secret=request.delete_old_secret)
+    return SecretRotationStatus(**secret_rotation.status())
+
+
+@router.get("/rotate-secrets", response_model=SecretRotationStatus)
+async def get_secret_rotation_status():
+    """Progress and per-tenant outcome of the current or last secret rotation"""
+    return SecretRotationStatus(**secret_rotation.status())
+
+
+@router.get("/circuit-breakers", response_model=List[CircuitBreakerStatus])
+async def get_circuit_breakers():
+    """Per-tenant circuit breaker state (tenants never called are not listed)"""
+    return [CircuitBreakerStatus(**status) for status in circuit_breakers.snapshot()]
+
+
+@router.get("/token-warmup", response_model=TokenWarmupStatus)
+async def get_token_warmup_status():
+    """Outcome of the last token pre-warm, including tenants that failed"""
+    return TokenWarmupStatus(**token_warmer.status())
+
+
+@router.post("/token-warmup", response_model=TokenWarmupStatus)
+async def run_token_warmup():
+    """Acquire tokens for all active tenants now"""
+    if token_warmer.running:
+        raise HTTPException(status_code=409, detail="令牌预热正在进行中")
+    # Shielded: a client disconnect must not cancel the run shared with status readers
+    await asyncio.shield(token_warmer.start())
+    return TokenWarmupStatus(**token_warmer.status())
+
+
 @router.get("/{tenant_id}", response_model=TenantResponse)
 async def get_tenant(
     tenant_id: int,
@@ -97,6 +265,7 @@ async def update_tenant(
     for field, value in update_data.items():
         setattr(tenant, field, value)
     
+    tenant_registry.invalidate(tenant.id, tenant.tenant_id)
     await db.flush()
     await db.refresh(tenant)
     
@@ -115,6 +284,12 @@ async def delete_tenant(
         raise HTTPException(status_code=404, detail="Tenant not found")
     
     await db.delete(tenant)
+    await db.execute(delete(DirectoryUser).where(DirectoryUser.tenant_id == tenant.id))
+    await db.execute(delete(DirectorySyncState).where(DirectorySyncState.tenant_id == tenant.id))
+    await db.execute(delete(LicenseUsageSample).where(LicenseUsageSample.tenant_id == tenant.id))
+    # Snapshots are keyed by the directory tenant ID, not the row id
+    await db.execute(delete(TenantReport).where(TenantReport.tenant_id == tenant.tenant_id))
+    tenant_registry.invalidate(tenant.id, tenant.tenant_id)
     
     return MessageResponse(message="Tenant deleted successfully")
 
@@ -130,13 +305,9 @@ async def validate_tenant(
     if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
     
-    msal_service = MSALService(
-        tenant_id=tenant.tenant_id,
-        client_id=tenant.client_id,
-        client_secret=tenant.client_secret
-    )
+    msal_service = tenant_registry.get_msal_service(tenant)
     
-    validation_result = await msal_service.validate_credentials()
+    validation_result = await msal_service.validate_credentials(force_refresh=True)
     checked_at = datetime.now()
     
     if not validation_result["valid"]:
@@ -173,11 +344,7 @@ async def check_tenant_spo_status(
     if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
     
-    msal_service = MSALService(
-        tenant_id=tenant.tenant_id,
-        client_id=tenant.client_id,
-        client_secret=tenant.client_secret
-    )
+    msal_service = tenant_registry.get_msal_service(tenant)
     
     validation_result = await msal_service.validate_credentials()
     if not validation_result["valid"]:
@@ -186,8 +353,12 @@ async def check_tenant_spo_status(
             detail=f"Invalid tenant credentials: {validation_result.get('error')}"
         )
     
-    graph_service = GraphAPIService(msal_service)
-    spo_result = await graph_service.check_spo_status()
+    graph_service = tenant_registry.get_graph_service(tenant)
+    try:
+        spo_result = await graph_service.check_spo_status()
+    except CircuitOpenError as e:
+        # Keep the last real status rather than recording the pause as an error
+        raise HTTPException(status_code=503, detail=str(e))
     
     checked_at = datetime.now()
     tenant.spo_status = spo_result["status"]
@@ -216,11 +387,7 @@ async def update_tenant_secret(
     if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
     
-    msal_service = MSALService(
-        tenant_id=tenant.tenant_id,
-        client_id=tenant.client_id,
-        client_secret=tenant.client_secret
-    )
+    msal_service = tenant_registry.get_msal_service(tenant)
     
     validation_result = await msal_service.validate_credentials()
     if not validation_result["valid"]:
@@ -229,7 +396,7 @@ async def update_tenant_secret(
             detail=f"Invalid tenant credentials: {validation_result.get('error')}"
         )
     
-    graph_service = GraphAPIService(msal_service)
+    graph_service = tenant_registry.get_graph_service(tenant)
     
     try:
         secret_result = await graph_service.update_client_secret(
@@ -247,6 +414,7 @@ async def update_tenant_secret(
             # Parse ISO 8601 datetime string (e.g., "2099-12-31T23:59:59Z")
             tenant.client_secret_expires_at = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
         
+        tenant_registry.invalidate(tenant.id, tenant.tenant_id)
         await db.flush()
         await db.refresh(tenant)
         
@@ -276,13 +444,8 @@ async def configure_tenant_permissions(
         if not tenant:
             raise HTTPException(status_code=404, detail="租户未找到")
         
-        # Create Graph API service for this tenant
-        msal_service = MSALService(
-            tenant_id=tenant.tenant_id,
-            client_id=tenant.client_id,
-            client_secret=tenant.client_secret
-        )
-        graph_service = GraphAPIService(msal_service)
+        # Get Graph API service for this tenant
+        graph_service = tenant_registry.get_graph_service(tenant)
         
         # Configure permissions via Graph API
         result = await graph_service.configure_application_permissions(tenant.client_id)
@@ -4,11 +4,11 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from app.database import get_db
+from app.database import AsyncSessionLocal
 from app.models import User
 from app.config import get_settings
+from app.services.principal_cache import principal_cache
 
 settings = get_settings()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -29,7 +29,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
-    to_encode.update({"exp": expire})
+    # iat lets cached principals be told apart per token issue
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
@@ -43,11 +44,19 @@ def verify_token(token: str) -> Optional[dict]:
 
 
 async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
+    credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> User:
+    """Resolve the bearer token to an active user
+    
+    Served from principal_cache on the hot path; the database is only hit for
+    a user that is not cached yet.
+    """
     token = credentials.credentials
-    payload = verify_token(token)
+    payload = principal_cache.get_payload(token)
+    if payload is None:
+        payload = verify_token(token)
+        if payload is not None:
+            principal_cache.put_payload(token, payload)
     
     if payload is None:
         raise HTTPException(
@@ -64,8 +73,15 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    result = await db.execute(select(User).where(User.username == username))
-    user = result.scalar_one_or_none()
+    issued_at = payload.get("iat")
+    user = principal_cache.get_user(username, issued_at)
+    if user is not None:
+        return user
+    
+    generation = principal_cache.generation(username)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User).where(User.username == username))
+        user = result.scalar_one_or_none()
     
     if user is None or not user.is_active:
         raise HTTPException(
@@ -74,4 +90,5 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    principal_cache.put_user(username, issued_at, user, generation)
     return user
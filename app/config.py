@@ -5,6 +5,24 @@ from typing import Optional
 
 class Settings(BaseSettings):
     database_url: str = "sqlite+aiosqlite:///./data/o365_manager.db"
+    
+    # Engine profile: statement echo is for debugging only; slow queries are logged instead
+    db_echo: bool = False
+    db_slow_query_ms: float = 200.0  # 0 disables the slow-query log
+    db_slow_query_sample_rate: float = 1.0
+    # Bound parameters may hold client secrets: only log them when explicitly enabled
+    db_slow_query_log_params: bool = False
+    # SQLite (WAL, pragmas applied on every new connection)
+    db_sqlite_pool_size: int = 5
+    db_sqlite_max_overflow: int = 10
+    db_sqlite_busy_timeout_ms: int = 5000
+    db_sqlite_mmap_size: int = 268435456  # 256 MiB
+    db_sqlite_cache_size_kib: int = 65536
+    # Server databases (PostgreSQL, MySQL, ...)
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30.0
+    db_pool_recycle_seconds: int = 1800
     api_host: str = "0.0.0.0"
     api_port: int = 8000
     api_reload: bool = True
@@ -13,9 +31,102 @@ class Settings(BaseSettings):
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
     
+    # In-process cache of decoded tokens and active users for get_current_user
+    auth_principal_cache_ttl_seconds: int = 60  # 0 disables the user cache
+    auth_principal_cache_max_size: int = 1024
+    auth_token_cache_max_size: int = 4096
+    
     graph_api_endpoint: str = "https://graph.microsoft.com/v1.0"
     graph_api_scope: str = "https://graph.microsoft.com/.default"
     
+    # Shared HTTP connection pool for Graph API calls
+    graph_http_limit: int = 100
+    graph_http_limit_per_host: int = 30
+    graph_http_keepalive_timeout: float = 60.0
+    graph_http_dns_cache_ttl: int = 300
+    graph_http_timeout: float = 120.0
+    graph_http_connect_timeout: float = 15.0
+    
+    # Retry policy for Graph API calls
+    graph_retry_max_attempts: int = 5
+    graph_retry_base_delay: float = 0.5
+    graph_retry_max_delay: float = 30.0
+    graph_request_deadline: float = 120.0
+    
+    # Per-tenant adaptive concurrency (AIMD) and token bucket
+    graph_tenant_initial_concurrency: int = 4
+    graph_tenant_min_concurrency: int = 1
+    graph_tenant_max_concurrency: int = 16
+    graph_tenant_rate_per_second: float = 10.0
+    graph_tenant_burst: int = 20
+    graph_latency_target_ms: float = 5000.0
+    graph_aimd_decrease_factor: float = 0.5
+    
+    # Per-tenant circuit breaker
+    circuit_breaker_failure_threshold: int = 5
+    circuit_breaker_cooldown_seconds: float = 60.0
+    circuit_breaker_credential_cooldown_seconds: float = 900.0
+    circuit_breaker_max_cooldown_seconds: float = 3600.0
+    
+    # Local users mirror kept in sync with Graph users/delta (0 disables the schedule)
+    directory_sync_interval_minutes: int = 30
+    directory_sync_concurrency: int = 4
+    
+    # Concurrent Graph fetches when refreshing license caches for many tenants
+    license_refresh_concurrency: int = 8
+    
+    # Concurrent credential checks when validating all tenants at once
+    credential_check_concurrency: int = 32
+    
+    # Concurrent tenants during bulk client secret rotation
+    secret_rotation_concurrency: int = 8
+    
+    # Fleet-wide SharePoint Online sweep (0 disables the scheduled run)
+    spo_sweep_interval_minutes: int = 360
+    spo_sweep_concurrency: int = 16
+    
+    # Cross-tenant user search fan-out
+    user_search_concurrency: int = 32
+    user_search_tenant_timeout: float = 10.0
+    
+    # Concurrent tenants when collecting fleet-wide user counts
+    user_stats_concurrency: int = 16
+    
+    # TenantReport snapshots for the fleet dashboard (0 disables the scheduled run)
+    tenant_snapshot_interval_minutes: int = 720
+    tenant_snapshot_concurrency: int = 8
+    tenant_snapshot_retention_days: int = 90
+    
+    # License cache lifetime and stale-while-revalidate background refresher
+    license_cache_ttl_hours: int = 24
+    license_refresher_enabled: bool = True
+    license_refresher_tick_seconds: int = 60
+    license_refresh_ahead_ratio: float = 0.8  # refresh once 80% of the TTL has passed
+    license_refresh_max_per_tick: int = 20
+    
+    # License usage history: hourly samples compacted to daily, then weekly ones (0 disables the compaction run)
+    license_history_hourly_days: int = 7
+    license_history_daily_days: int = 90
+    license_history_retention_days: int = 730
+    license_history_compact_interval_minutes: int = 360
+    
+    # JSON $batch (20 sub-requests per call)
+    graph_batch_concurrency: int = 4
+    graph_batch_max_retries: int = 3
+    
+    # Access token cache (MSAL itself re-issues tokens with < 5 minutes left)
+    token_provider_max_workers: int = 16
+    token_expiry_skew_seconds: int = 60
+    token_refresh_ahead_seconds: int = 240
+    
+    # Acquire tokens for all active tenants at startup and keep them renewed
+    token_prewarm_enabled: bool = True
+    token_prewarm_concurrency: int = 16
+    token_prewarm_timeout: float = 30.0
+    
+    # Long-lived per-tenant MSAL/Graph service instances (LRU bound)
+    tenant_registry_max_size: int = 1000
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -2,16 +2,14 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sess
 from sqlalchemy.orm import declarative_base
 from sqlalchemy import text
 from app.config import get_settings
+from app.db_profile import engine_options, configure_engine
 import logging
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
-engine = create_async_engine(
-    settings.database_url,
-    echo=True,
-    future=True
-)
+engine = create_async_engine(settings.database_url, **engine_options(settings))
+configure_engine(engine.sync_engine, settings)
 
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -36,33 +34,70 @@ async def get_db():
             await session.close()
 
 
+# (table, column, DDL type) added to existing databases by run_migrations
+COLUMN_MIGRATIONS = [
+    ("license_cache", "expires_at", "TIMESTAMP"),
+    ("tenants", "license_refresh_minutes", "INTEGER"),
+]
+
+# Rows written with SQLite's CURRENT_TIMESTAMP lack the fractional seconds
+# SQLAlchemy writes; rewrite them so keyset cursors compare correctly
+NORMALIZE_TIMESTAMPS = [
+    ("tenants", "created_at"),
+]
+
+# Unique keys added after the table shipped: duplicates (keeping the newest
+# row) are removed before create_missing_indexes builds the unique index
+UNIQUE_KEY_MIGRATIONS = [
+    ("license_cache", ("tenant_id", "sku_id")),
+]
+
+
+def create_missing_indexes(sync_conn):
+    """create_all skips indexes of tables that already exist"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
 async def run_migrations():
     """运行数据库迁移"""
     try:
         async with engine.begin() as conn:
-            # 迁移1: 为 license_cache 表添加 expires_at 字段
             logger.info("Checking database migrations...")
             
-            # SQLite 使用 PRAGMA table_info 来检查列是否存在
-            check_column_query = text("PRAGMA table_info(license_cache)")
-            result = await conn.execute(check_column_query)
-            columns = result.fetchall()
-            
-            if columns:  # 表存在
-                column_names = [col[1] for col in columns]
+            for table, column, column_type in COLUMN_MIGRATIONS:
+                # SQLite 使用 PRAGMA table_info 来检查列是否存在
+                result = await conn.execute(text(f"PRAGMA table_info({table})"))
+                columns = result.fetchall()
                 
-                if 'expires_at' not in column_names:
-                    logger.info("Running migration: Adding expires_at column to license_cache table...")
-                    alter_table_query = text("""
-                        ALTER TABLE license_cache 
-                        ADD COLUMN expires_at TIMESTAMP
-                    """)
-                    await conn.execute(alter_table_query)
-                    logger.info("Migration completed: expires_at column added successfully")
+                if not columns:
+                    logger.info(f"{table} table does not exist yet, will be created by init_db")
+                    continue
+                
+                column_names = [col[1] for col in columns]
+                if column not in column_names:
+                    logger.info(f"Running migration: Adding {column} column to {table} table...")
+                    await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+                    logger.info(f"Migration completed: {column} column added successfully")
                 else:
-                    logger.info("Migration check: expires_at column already exists")
-            else:
-                logger.info("license_cache table does not exist yet, will be created by init_db")
+                    logger.info(f"Migration check: {table}.{column} column already exists")
+            
+            for table, column in NORMALIZE_TIMESTAMPS:
+                await conn.execute(text(
+                    f"UPDATE {table} SET {column} = strftime('%Y-%m-%d %H:%M:%f000', {column}) "
+                    f"WHERE {column} IS NOT NULL AND {column} NOT LIKE '%.%'"
+                ))
+            
+            for table, columns in UNIQUE_KEY_MIGRATIONS:
+                key = ", ".join(columns)
+                result = await conn.execute(text(
+                    f"DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {key})"
+                ))
+                if result.rowcount:
+                    logger.info(f"Migration: removed {result.rowcount} duplicate rows from {table} ({key})")
+            
+            await conn.run_sync(create_missing_indexes)
                 
     except Exception as e:
         logger.error(f"Migration error: {str(e)}")
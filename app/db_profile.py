@@ -0,0 +1,129 @@
+"""
+Database engine profile
+
+Engine options tuned per backend, plus the connection hooks that go with
+them:
+
+- SQLite: WAL journal, synchronous=NORMAL, busy_timeout, mmap and page cache
+  pragmas on every new connection, and a small pool of reused connections
+  (aiosqlite otherwise opens a new connection per session).
+- Server databases (PostgreSQL, MySQL, ...): a bounded pool with pre-ping
+  and recycling.
+
+Statement logging is a sampled slow-query log (SQL and duration) instead of
+echoing every statement. Bound parameters can carry client secrets, so they
+are only logged with DB_SLOW_QUERY_LOG_PARAMS enabled.
+"""
+
+import logging
+import random
+import time
+from typing import Any, Dict
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app.config import Settings
+
+logger = logging.getLogger("app.db.slow_query")
+
+# Keep slow-query log lines bounded
+MAX_LOGGED_SQL = 2000
+MAX_LOGGED_PARAMS = 500
+
+
+def is_sqlite(database_url: str) -> bool:
+    return make_url(database_url).get_backend_name() == "sqlite"
+
+
+def is_sqlite_memory(database_url: str) -> bool:
+    database = make_url(database_url).database
+    return not database or database == ":memory:"
+
+
+def engine_options(settings: Settings) -> Dict[str, Any]:
+    """Keyword arguments for create_async_engine"""
+    options: Dict[str, Any] = {"echo": settings.db_echo, "future": True}
+
+    if is_sqlite(settings.database_url):
+        if not is_sqlite_memory(settings.database_url):
+            options.update(
+                poolclass=AsyncAdaptedQueuePool,
+                pool_size=settings.db_sqlite_pool_size,
+                max_overflow=settings.db_sqlite_max_overflow,
+                pool_timeout=settings.db_pool_timeout,
+            )
+        return options
+
+    options.update(
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle_seconds,
+        pool_pre_ping=True,
+    )
+    return options
+
+
+def sqlite_pragmas(settings: Settings, memory: bool = False) -> Dict[str, Any]:
+    pragmas: Dict[str, Any] = {
+        "synchronous": "NORMAL",
+        "busy_timeout": settings.db_sqlite_busy_timeout_ms,
+        # Negative cache_size is in KiB rather than pages
+        "cache_size": -settings.db_sqlite_cache_size_kib,
+        "temp_store": "MEMORY",
+    }
+    if not memory:
+        pragmas = {"journal_mode": "WAL", "mmap_size": settings.db_sqlite_mmap_size, **pragmas}
+    return pragmas
+
+
+def install_sqlite_pragmas(engine: Engine, settings: Settings) -> None:
+    pragmas = sqlite_pragmas(settings, memory=is_sqlite_memory(settings.database_url))
+
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def install_slow_query_log(engine: Engine, settings: Settings) -> None:
+    threshold = settings.db_slow_query_ms / 1000
+    sample_rate = settings.db_slow_query_sample_rate
+    log_params = settings.db_slow_query_log_params
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        if elapsed < threshold or random.random() >= sample_rate:
+            return
+        batch = f", executemany x{len(parameters)}" if executemany else ""
+        if log_params:
+            logger.warning(
+                "Slow query (%.1f ms%s): %s | params: %s",
+                elapsed * 1000, batch, statement[:MAX_LOGGED_SQL], repr(parameters)[:MAX_LOGGED_PARAMS],
+            )
+        else:
+            logger.warning("Slow query (%.1f ms%s): %s", elapsed * 1000, batch, statement[:MAX_LOGGED_SQL])
+
+    @event.listens_for(engine, "handle_error")
+    def _drop_timer(exception_context):
+        # after_cursor_execute never runs for a failed statement
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+
+
+def configure_engine(engine: Engine, settings: Settings) -> None:
+    """Attach the profile's hooks to the sync engine behind an AsyncEngine"""
+    if is_sqlite(settings.database_url):
+        install_sqlite_pragmas(engine, settings)
+    if settings.db_slow_query_ms > 0:
+        install_slow_query_log(engine, settings)
@@ -5,6 +5,16 @@ from fastapi.responses import FileResponse
 from contextlib import asynccontextmanager
 from pathlib import Path
 from app.database import init_db
+from app.services.http_session import init_http_session, close_http_session
+from app.services.token_provider import token_provider
+from app.services.token_warmer import token_warmer
+from app.services.secret_rotation import secret_rotation
+from app.services.scheduler import scheduler, PeriodicJob
+from app.services.directory_mirror import sync_all_tenants
+from app.services.license_refresher import license_refresher
+from app.services.tenant_health import sweep_spo_status
+from app.services.tenant_snapshot import snapshot_all_tenants
+from app.services.license_history import compact_license_history
 from app.api import auth, tenants, o365_users, licenses, domains, roles, reports
 from app.config import get_settings
 
@@ -14,7 +24,55 @@ settings = get_settings()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    await init_http_session()
+    if settings.token_prewarm_enabled:
+        token_warmer.start()
+    
+    if settings.directory_sync_interval_minutes > 0:
+        scheduler.add(PeriodicJob(
+            "directory_sync",
+            settings.directory_sync_interval_minutes * 60,
+            sync_all_tenants,
+            initial_delay=60
+        ))
+    if settings.license_refresher_enabled:
+        scheduler.add(PeriodicJob(
+            "license_refresher",
+            settings.license_refresher_tick_seconds,
+            license_refresher.tick,
+            initial_delay=30
+        ))
+    if settings.spo_sweep_interval_minutes > 0:
+        scheduler.add(PeriodicJob(
+            "spo_sweep",
+            settings.spo_sweep_interval_minutes * 60,
+            sweep_spo_status,
+            initial_delay=120
+        ))
+    if settings.tenant_snapshot_interval_minutes > 0:
+        scheduler.add(PeriodicJob(
+            "tenant_snapshot",
+            settings.tenant_snapshot_interval_minutes * 60,
+            snapshot_all_tenants,
+            initial_delay=300
+        ))
+    if settings.license_history_compact_interval_minutes > 0:
+        scheduler.add(PeriodicJob(
+            "license_history_compact",
+            settings.license_history_compact_interval_minutes * 60,
+            compact_license_history,
+            initial_delay=600
+        ))
+    scheduler.start()
+    
     yield
+    
+    await scheduler.stop()
+    await token_warmer.stop()
+    await secret_rotation.stop()
+    await license_refresher.shutdown()
+    await token_provider.shutdown()
+    await close_http_session()
 
 
 app = FastAPI(
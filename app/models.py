@@ -1,27 +1,35 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, UniqueConstraint, Index
 from sqlalchemy.sql import func
 from app.database import Base
 
 
 class Tenant(Base):
     __tablename__ = "tenants"
+    __table_args__ = (
+        # Keyset pagination of the tenant list (newest first)
+        Index("ix_tenants_created_at_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     tenant_id = Column(String(100), unique=True, nullable=False, index=True)
     client_id = Column(String(100), nullable=False)
     client_secret = Column(String(200), nullable=False)
-    client_secret_expires_at = Column(DateTime(timezone=True))
+    client_secret_expires_at = Column(DateTime(timezone=True), index=True)
     tenant_name = Column(String(200))
     remarks = Column(Text)
-    is_active = Column(Boolean, default=True)
+    is_active = Column(Boolean, default=True, index=True)
     is_selected = Column(Boolean, default=False)
-    credential_status = Column(String(50))
+    credential_status = Column(String(50), index=True)
     credential_message = Column(String(200))
     credential_checked_at = Column(DateTime(timezone=True))
-    spo_status = Column(String(50))
+    spo_status = Column(String(50), index=True)
     spo_message = Column(String(200))
     spo_checked_at = Column(DateTime(timezone=True))
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    license_refresh_minutes = Column(Integer)  # NULL: use LICENSE_CACHE_TTL_HOURS
+    # Set client-side too, so every row is stored in the same format and compares
+    # correctly against keyset cursors (SQLite CURRENT_TIMESTAMP has no fraction)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     created_by = Column(String(100))
     updated_by = Column(String(100))
@@ -65,6 +73,11 @@ class SystemConfig(Base):
 
 class LicenseCache(Base):
     __tablename__ = "license_cache"
+    __table_args__ = (
+        # A unique index rather than a table constraint, so existing databases get it too
+        Index("uq_license_cache_tenant_sku", "tenant_id", "sku_id", unique=True),
+        Index("ix_license_cache_tenant_cached_at", "tenant_id", "cached_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     tenant_id = Column(Integer, nullable=False, index=True)
@@ -78,3 +91,54 @@ class LicenseCache(Base):
     cached_at = Column(DateTime(timezone=True), server_default=func.now())
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+
+# License usage history, run-length encoded: a row holds one (consumed, enabled)
+# value per tenant and SKU from bucket_start until last_seen_at. Buckets start
+# hourly and are compacted to daily, then weekly ones as they age.
+class LicenseUsageSample(Base):
+    __tablename__ = "license_usage_samples"
+    __table_args__ = (
+        Index("uq_license_usage_tenant_sku_bucket", "tenant_id", "sku_id", "bucket_start", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    tenant_id = Column(Integer, nullable=False)
+    sku_id = Column(String(100), nullable=False)
+    sku_part_number = Column(String(200), nullable=False)
+    resolution = Column(String(10), nullable=False, default="hour", index=True)  # hour / day / week
+    bucket_start = Column(DateTime(timezone=True), nullable=False)
+    last_seen_at = Column(DateTime(timezone=True), nullable=False)
+    consumed_units = Column(Integer, default=0)
+    enabled_units = Column(Integer, default=0)
+
+
+class DirectoryUser(Base):
+    __tablename__ = "directory_users"
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "object_id", name="uq_directory_users_tenant_object"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    tenant_id = Column(Integer, nullable=False, index=True)
+    object_id = Column(String(100), nullable=False)
+    display_name = Column(String(256))
+    user_principal_name = Column(String(256), index=True)
+    mail = Column(String(256))
+    account_enabled = Column(Boolean)
+    usage_location = Column(String(10))
+    user_type = Column(String(20))
+    created_datetime = Column(String(40))
+    synced_at = Column(DateTime(timezone=True))
+
+
+class DirectorySyncState(Base):
+    __tablename__ = "directory_sync_state"
+    
+    tenant_id = Column(Integer, primary_key=True)
+    delta_link = Column(Text)
+    status = Column(String(50))
+    message = Column(String(500))
+    user_count = Column(Integer, default=0)
+    last_synced_at = Column(DateTime(timezone=True))
+    last_full_sync_at = Column(DateTime(timezone=True))
@@ -1,8 +1,25 @@
-from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field, AliasChoices
+from typing import Any, Optional, List, Type
 from datetime import datetime
 
 
+def graph_field(graph_name: str, field_name: str, *args, **kwargs):
+    """Field populated from a Microsoft Graph property (camelCase) or its own snake_case name"""
+    return Field(*args, validation_alias=AliasChoices(graph_name, field_name), **kwargs)
+
+
+def graph_fields(model: Type[BaseModel]) -> List[str]:
+    """Graph properties a response model needs, for use as $select"""
+    fields = []
+    for name, info in model.model_fields.items():
+        alias = info.validation_alias
+        if isinstance(alias, AliasChoices):
+            fields.append(alias.choices[0])
+        else:
+            fields.append(alias or name)
+    return fields
+
+
 class TenantBase(BaseModel):
     tenant_id: str = Field(..., description="Microsoft 365 Tenant ID")
     client_id: str = Field(..., description="Azure AD Application (Client) ID")
@@ -21,6 +38,7 @@ class TenantUpdate(BaseModel):
     tenant_name: Optional[str] = None
     remarks: Optional[str] = None
     is_active: Optional[bool] = None
+    license_refresh_minutes: Optional[int] = Field(None, ge=5, description="License cache refresh interval (minutes)")
 
 
 class TenantResponse(BaseModel):
@@ -40,6 +58,7 @@ class TenantResponse(BaseModel):
     spo_status: Optional[str] = None
     spo_message: Optional[str] = None
     spo_checked_at: Optional[datetime] = None
+    license_refresh_minutes: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -48,6 +67,7 @@ class TenantResponse(BaseModel):
 class TenantListResponse(BaseModel):
     total: int
     items: list[TenantResponse]
+    next_cursor: Optional[str] = None  # pass as `cursor` to get the next page
 
 
 class UserBase(BaseModel):
@@ -89,20 +109,77 @@ class O365UserUpdate(BaseModel):
 
 class O365UserResponse(BaseModel):
     id: str
-    display_name: str
-    user_principal_name: str
+    display_name: str = graph_field("displayName", "display_name")
+    user_principal_name: str = graph_field("userPrincipalName", "user_principal_name")
     mail: Optional[str] = None
-    account_enabled: bool
-    usage_location: Optional[str] = None
-    created_datetime: Optional[str] = None
+    account_enabled: bool = graph_field("accountEnabled", "account_enabled")
+    usage_location: Optional[str] = graph_field("usageLocation", "usage_location", None)
+    created_datetime: Optional[str] = graph_field("createdDateTime", "created_datetime", None)
+
+
+class CrossTenantUserMatch(BaseModel):
+    tenant_id: int
+    tenant_name: Optional[str] = None
+    user: Optional[O365UserResponse] = None
+    error: Optional[str] = Field(None, description="Set on a per-tenant failure or timeout (user is then empty)")
+
+
+class UserCountStats(BaseModel):
+    tenant_id: int
+    tenant_name: Optional[str] = None
+    total: Optional[int] = None
+    enabled: Optional[int] = None
+    disabled: Optional[int] = None
+    guests: Optional[int] = None
+    error: Optional[str] = None
+
+
+class FleetUserCountStats(BaseModel):
+    tenants: int
+    failed: int
+    total: int
+    enabled: int
+    disabled: int
+    guests: int
+    items: list[UserCountStats]
+
+
+class DirectorySyncStatusResponse(BaseModel):
+    tenant_id: int
+    status: Optional[str] = None
+    message: Optional[str] = None
+    user_count: int = 0
+    last_synced_at: Optional[datetime] = None
+    last_full_sync_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class DirectorySyncResult(BaseModel):
+    tenant_id: int
+    mode: str = Field(..., description="full|delta")
+    upserted: int
+    removed: int
+    user_count: int
+    synced_at: datetime
+
+
+class DirectoryUserCountResponse(BaseModel):
+    tenant_id: int
+    total: int
+    enabled: int
+    disabled: int
+    guests: int
+    synced_at: Optional[datetime] = None
 
 
 class O365DomainResponse(BaseModel):
     id: str
-    authentication_type: str
-    is_default: bool
-    is_verified: bool
-    supported_services: list[str]
+    authentication_type: str = graph_field("authenticationType", "authentication_type")
+    is_default: bool = graph_field("isDefault", "is_default")
+    is_verified: bool = graph_field("isVerified", "is_verified")
+    supported_services: list[str] = graph_field("supportedServices", "supported_services")
 
 
 class O365LicenseResponse(BaseModel):
@@ -115,6 +192,55 @@ class O365LicenseResponse(BaseModel):
     expires_at: Optional[datetime] = None
 
 
+class TenantLicenseSummary(BaseModel):
+    tenant_id: int
+    tenant_name: Optional[str] = None
+    source: str = Field(..., description="cache|graph|error")
+    cached_at: Optional[datetime] = None
+    total_enabled: int = 0
+    total_consumed: int = 0
+    licenses: list[O365LicenseResponse] = []
+    stale: bool = False
+    error: Optional[str] = None
+
+
+class LicenseRefreshQueueEntry(BaseModel):
+    tenant_id: int
+    tenant_name: Optional[str] = None
+    interval_minutes: int
+    cached_at: Optional[datetime] = None
+    due_at: datetime
+    stale: bool
+    in_progress: bool
+    failures: int = 0
+    retry_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+
+class LicenseUsagePoint(BaseModel):
+    at: datetime
+    consumed_units: int
+    enabled_units: int
+
+
+class LicenseUsageTrend(BaseModel):
+    tenant_id: int
+    tenant_name: Optional[str] = None
+    sku_id: str
+    sku_part_number: str
+    sku_name_cn: Optional[str] = None
+    consumed_units: int
+    enabled_units: int
+    available_units: int
+    first_seen_at: datetime
+    last_seen_at: datetime
+    consumed_change: int = Field(..., description="Change in consumed units over the window")
+    burn_rate_per_day: Optional[float] = Field(None, description="Least-squares trend of consumed units per day")
+    days_until_exhausted: Optional[float] = None
+    projected_exhausted_at: Optional[datetime] = None
+    points: list[LicenseUsagePoint] = []
+
+
 class O365RoleAssignment(BaseModel):
     user_id: str
     role_id: str = Field(..., description="Directory role template ID (e.g., 62e90394-69f5-4237-9190-012177145e10 for Global Administrator)")
@@ -155,3 +281,116 @@ class SpoStatusResponse(BaseModel):
     status: str = Field(..., description="SPO status: available|unavailable|no_subscription|unknown|error")
     message: str = Field(..., description="Status message")
     checked_at: datetime = Field(..., description="Time when SPO status was checked")
+
+
+class CredentialCheckResult(BaseModel):
+    tenant_id: int
+    tenant_name: Optional[str] = None
+    valid: bool
+    message: str
+    error: Optional[str] = None
+    checked_at: datetime
+
+
+class SpoSweepResult(BaseModel):
+    total: int
+    checked: int
+    skipped: int = Field(..., description="Tenants skipped because their credentials are invalid or their circuit is open")
+    statuses: dict[str, int] = {}
+
+
+class TenantSnapshotResponse(BaseModel):
+    tenant_id: int
+    tenant_name: Optional[str] = None
+    is_active: bool
+    snapshot_at: Optional[datetime] = None
+    total_users: Optional[int] = None
+    total_admins: Optional[int] = None
+    spo_available: Optional[bool] = None
+    report_data: dict[str, Any] = {}
+
+
+class FleetDashboardResponse(BaseModel):
+    tenants: int
+    snapshotted: int
+    total_users: int
+    total_admins: int
+    spo_available: int
+    oldest_snapshot_at: Optional[datetime] = None
+    items: list[TenantSnapshotResponse]
+
+
+class SnapshotRunResult(BaseModel):
+    total: int
+    written: int
+    failed: int
+    skipped: int = Field(..., description="Tenants skipped because their credentials are invalid or their circuit is open")
+
+
+class TokenWarmupFailure(BaseModel):
+    tenant_id: int
+    tenant_name: Optional[str] = None
+    error: str
+
+
+class TokenWarmupStatus(BaseModel):
+    running: bool
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    total: int = 0
+    warmed: int = 0
+    failed: list[TokenWarmupFailure] = []
+
+
+class CircuitBreakerStatus(BaseModel):
+    tenant_id: str = Field(..., description="Microsoft 365 Tenant ID")
+    state: str = Field(..., description="closed|open|half_open")
+    failures: int
+    kind: Optional[str] = Field(None, description="credentials|unreachable")
+    reason: Optional[str] = None
+    opened_at: Optional[datetime] = None
+    retry_at: Optional[datetime] = None
+
+
+class SecretRotationRequest(BaseModel):
+    expires_within_days: int = Field(30, ge=0, description="Rotate secrets expiring within this many days")
+    tenant_ids: Optional[List[int]] = Field(None, description="Limit to these tenants (default: all active tenants)")
+    include_unknown_expiry: bool = Field(False, description="Also rotate tenants without a recorded expiry")
+    delete_old_secret: bool = False
+
+
+class SecretRotationTenantResult(BaseModel):
+    tenant_id: int
+    tenant_name: Optional[str] = None
+    status: str = Field(..., description="pending|created|rotated|failed")
+    previous_expires_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    old_secret_removed: Optional[bool] = None
+    error: Optional[str] = None
+
+
+class SecretRotationStatus(BaseModel):
+    running: bool
+    phase: Optional[str] = Field(None, description="adding|saving|removing|invalidating|completed|failed|cancelled")
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    delete_old_secret: bool = False
+    total: int = 0
+    pending: int = 0
+    created: int = 0
+    rotated: int = 0
+    failed: int = 0
+    error: Optional[str] = None
+    results: list[SecretRotationTenantResult] = []
+
+
+class GraphRequestStatsResponse(BaseModel):
+    tenant_id: str = Field(..., description="Microsoft 365 Tenant ID")
+    requests: int = Field(..., description="HTTP attempts sent to Graph")
+    retries: int = Field(..., description="Attempts that were retried")
+    throttled: int = Field(..., description="Retries caused by HTTP 429")
+    token_refreshes: int = Field(..., description="Forced token refreshes after HTTP 401")
+    deadline_exceeded: int = Field(..., description="Calls abandoned at their deadline")
+    sleep_seconds: float = Field(..., description="Total time spent backing off")
+    concurrency_limit: Optional[float] = Field(None, description="Current adaptive concurrency window")
+    in_flight: Optional[int] = Field(None, description="Graph calls currently in flight")
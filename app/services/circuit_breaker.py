@@ -0,0 +1,253 @@
+"""
+Per-tenant circuit breaker
+
+Stops sending token and Graph requests for a tenant that keeps failing in a
+way retries cannot fix. Failures are classified by type:
+
+- credentials: AAD rejected the app (bad or expired secret, unknown app or
+  tenant). One failure opens the circuit for a long cooldown.
+- unreachable: connection errors, timeouts and 5xx after retries. The
+  circuit opens after several consecutive failures, for a short cooldown.
+
+While open, calls fail immediately with the cached reason. Once the
+cooldown has elapsed the circuit is half-open: a single probe call goes
+through (other callers still fail fast) and its outcome closes the circuit
+or re-opens it with a doubled cooldown. When a
+circuit opens or closes because of credentials, the tenant's
+credential_status is updated.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+import aiohttp
+from sqlalchemy import update
+from app.config import get_settings
+from app.database import AsyncSessionLocal
+from app.models import Tenant
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+CREDENTIALS = "credentials"
+UNREACHABLE = "unreachable"
+
+# AAD errors that no retry will fix until someone changes the tenant's credentials
+CREDENTIAL_ERROR_MARKERS = (
+    "AADSTS7000215",  # invalid client secret
+    "AADSTS7000222",  # client secret expired
+    "AADSTS700016",   # application not found in tenant
+    "AADSTS90002",    # tenant not found
+    "AADSTS90072",    # account does not exist in tenant
+    "invalid_client",
+    "unauthorized_client",
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling MSAL/Graph while a tenant's circuit is open"""
+
+    def __init__(self, tenant_id: str, kind: str, reason: str, retry_at: datetime):
+        super().__init__(f"Circuit open for tenant {tenant_id} until {retry_at.isoformat()}Z: {reason}")
+        self.tenant_id = tenant_id
+        self.kind = kind
+        self.reason = reason
+        self.retry_at = retry_at
+
+
+# Transport failures: aiohttp for Graph calls; MSAL's HTTP client raises IOError
+# subclasses for connection errors and timeouts of token calls
+UNREACHABLE_ERRORS = (
+    aiohttp.ClientConnectionError,
+    asyncio.TimeoutError,
+    OSError,
+)
+
+# The task that claimed a half-open probe passes nested checks (Graph call -> token fetch)
+_probe_owner: ContextVar[Optional[int]] = ContextVar("circuit_probe_owner", default=None)
+_probe_ids = itertools.count(1)
+
+
+def classify_failure(error: BaseException) -> Optional[str]:
+    """Breaker-relevant failure kind, or None if the tenant did answer properly"""
+    # AAD reports credential problems only as error codes inside the message
+    if any(marker in str(error) for marker in CREDENTIAL_ERROR_MARKERS):
+        return CREDENTIALS
+    if isinstance(error, UNREACHABLE_ERRORS):
+        return UNREACHABLE
+    status = getattr(error, "status", None)
+    if isinstance(status, int):
+        return UNREACHABLE if status >= 500 else None
+    return None
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        tenant_id: str,
+        failure_threshold: int = settings.circuit_breaker_failure_threshold,
+        cooldown: float = settings.circuit_breaker_cooldown_seconds,
+        credential_cooldown: float = settings.circuit_breaker_credential_cooldown_seconds,
+        max_cooldown: float = settings.circuit_breaker_max_cooldown_seconds,
+    ):
+        self.tenant_id = tenant_id
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.credential_cooldown = credential_cooldown
+        self.max_cooldown = max_cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.kind: Optional[str] = None
+        self.reason: Optional[str] = None
+        self.opened_at: Optional[datetime] = None
+        self.open_until = 0.0  # time.monotonic() based
+        self.current_cooldown = 0.0
+        # Half-open lets a single probe call through; a probe that never reports
+        # back (e.g. cancelled) is given up after probe_timeout
+        self.probe_id: Optional[int] = None
+        self.probe_started = 0.0
+        self.probe_timeout = settings.graph_request_deadline
+
+    @property
+    def retry_at(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=max(self.open_until - time.monotonic(), 0))
+
+    def check(self) -> None:
+        """Raise CircuitOpenError while open; once the cooldown is over let one probe through"""
+        if self.state == CLOSED:
+            return
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now < self.open_until:
+                raise CircuitOpenError(self.tenant_id, self.kind, self.reason, self.retry_at)
+            self.state = HALF_OPEN
+            logger.info(f"Circuit for tenant {self.tenant_id} half-open, probing")
+        elif self.probe_id is not None and now - self.probe_started < self.probe_timeout:
+            if self.owns_probe():
+                return
+            raise CircuitOpenError(self.tenant_id, self.kind, self.reason, self.retry_at)
+        self.probe_id = next(_probe_ids)
+        self.probe_started = now
+        _probe_owner.set(self.probe_id)
+
+    def owns_probe(self) -> bool:
+        return self.probe_id is not None and _probe_owner.get() == self.probe_id
+
+    def record_success(self) -> None:
+        if self.state == CLOSED:
+            self.failures = 0
+            return
+        previous_kind = self.kind
+        self.state = CLOSED
+        self.failures = 0
+        self.kind = self.reason = self.opened_at = None
+        self.probe_id = None
+        self.current_cooldown = 0.0
+        logger.info(f"Circuit for tenant {self.tenant_id} closed")
+        if previous_kind == CREDENTIALS:
+            circuit_breakers.notify(self.tenant_id, valid=True, message="凭据有效")
+
+    def record_failure(self, error: BaseException) -> None:
+        if isinstance(error, CircuitOpenError):
+            return
+        kind = classify_failure(error)
+        if kind is None:
+            # The tenant answered (e.g. 403/404): it is reachable and authenticated.
+            # That only counts when it is the probe's answer; a late reply to a
+            # request sent before the circuit opened must not close it.
+            if self.state == CLOSED or (self.state == HALF_OPEN and self.owns_probe()):
+                self.record_success()
+            return
+        if self.state == OPEN:
+            # Same failure seen again by an outer layer (token provider, then Graph call)
+            return
+
+        self.failures += 1
+        if self.state == HALF_OPEN:
+            cooldown = min(max(self.current_cooldown * 2, self.cooldown), self.max_cooldown)
+        elif kind == CREDENTIALS:
+            cooldown = self.credential_cooldown
+        elif self.failures >= self.failure_threshold:
+            cooldown = self.cooldown
+        else:
+            return
+        self._open(kind, str(error) or type(error).__name__, cooldown)
+
+    def _open(self, kind: str, reason: str, cooldown: float) -> None:
+        self.state = OPEN
+        self.probe_id = None
+        self.kind = kind
+        self.reason = reason[:500]
+        self.opened_at = datetime.utcnow()
+        self.current_cooldown = cooldown
+        self.open_until = time.monotonic() + cooldown
+        logger.warning(f"Circuit for tenant {self.tenant_id} opened for {cooldown:.0f}s ({kind}): {reason}")
+        if kind == CREDENTIALS:
+            circuit_breakers.notify(self.tenant_id, valid=False, message=f"凭据无效: {reason}"[:200])
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "tenant_id": self.tenant_id,
+            "state": self.state,
+            "failures": self.failures,
+            "kind": self.kind,
+            "reason": self.reason,
+            "opened_at": self.opened_at,
+            "retry_at": self.retry_at if self.state == OPEN else None,
+        }
+
+
+class CircuitBreakerRegistry:
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def get(self, tenant_id: str) -> CircuitBreaker:
+        breaker = self._breakers.get(tenant_id)
+        if breaker is None:
+            breaker = self._breakers[tenant_id] = CircuitBreaker(tenant_id)
+        return breaker
+
+    def reset(self, tenant_id: str) -> None:
+        """Forget a tenant's breaker (its credentials changed)"""
+        self._breakers.pop(tenant_id, None)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [breaker.status() for breaker in self._breakers.values()]
+
+    def notify(self, tenant_id: str, valid: bool, message: str) -> None:
+        """Persist a credential verdict reached by a breaker, without blocking the caller"""
+        try:
+            task = asyncio.get_running_loop().create_task(self._save_credential_status(tenant_id, valid, message))
+        except RuntimeError:
+            return
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _save_credential_status(tenant_id: str, valid: bool, message: str) -> None:
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Tenant)
+                    .where(Tenant.tenant_id == tenant_id)
+                    .values(
+                        credential_status="valid" if valid else "invalid",
+                        credential_message=message,
+                        credential_checked_at=datetime.now(),
+                    )
+                )
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Failed to save credential status for tenant {tenant_id}: {e}")
+
+
+circuit_breakers = CircuitBreakerRegistry()
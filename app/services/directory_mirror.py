@@ -0,0 +1,221 @@
+"""
+Directory mirror
+
+Keeps a local copy of each tenant's users in sync with Graph `users/delta`.
+The delta link returned at the end of every round is persisted in
+DirectorySyncState, so later rounds only fetch objects that changed.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+from sqlalchemy import select, delete, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_settings
+from app.database import AsyncSessionLocal
+from app.models import Tenant, DirectoryUser, DirectorySyncState
+from app.services.graph_service import GraphAPIError
+from app.services.tenant_registry import tenant_registry
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Graph user property -> DirectoryUser column
+MIRRORED_FIELDS = {
+    "displayName": "display_name",
+    "userPrincipalName": "user_principal_name",
+    "mail": "mail",
+    "accountEnabled": "account_enabled",
+    "usageLocation": "usage_location",
+    "userType": "user_type",
+    "createdDateTime": "created_datetime",
+}
+
+MIRROR_SELECT = ["id", *MIRRORED_FIELDS]
+
+_sync_locks: Dict[int, asyncio.Lock] = {}
+
+
+async def _apply_page(
+    db: AsyncSession,
+    tenant_row_id: int,
+    page: List[Dict[str, Any]],
+    synced_at: datetime
+) -> Tuple[int, int]:
+    """Merge one delta page into the mirror; returns (upserted, removed)"""
+    object_ids = [item["id"] for item in page if item.get("id")]
+    if not object_ids:
+        return 0, 0
+
+    result = await db.execute(
+        select(DirectoryUser)
+        .where(DirectoryUser.tenant_id == tenant_row_id)
+        .where(DirectoryUser.object_id.in_(object_ids))
+    )
+    existing = {row.object_id: row for row in result.scalars().all()}
+
+    upserted = removed = 0
+    for item in page:
+        object_id = item.get("id")
+        if not object_id:
+            continue
+        row = existing.get(object_id)
+
+        if "@removed" in item:
+            if row is not None:
+                await db.delete(row)
+                removed += 1
+            continue
+
+        if row is None:
+            row = DirectoryUser(tenant_id=tenant_row_id, object_id=object_id)
+            db.add(row)
+            existing[object_id] = row
+        # Changed objects only carry the properties that changed
+        for graph_field, column in MIRRORED_FIELDS.items():
+            if graph_field in item:
+                setattr(row, column, item[graph_field])
+        row.synced_at = synced_at
+        upserted += 1
+
+    await db.flush()
+    return upserted, removed
+
+
+async def _sync(db: AsyncSession, tenant: Tenant, full: bool) -> Dict[str, Any]:
+    state = await db.get(DirectorySyncState, tenant.id)
+    if state is None:
+        state = DirectorySyncState(tenant_id=tenant.id)
+        db.add(state)
+
+    delta_link = None if full else state.delta_link
+    full = delta_link is None
+    started = datetime.utcnow()
+    graph_service = tenant_registry.get_graph_service(tenant)
+
+    upserted = removed = 0
+    new_delta_link = None
+    try:
+        pages = graph_service.iter_users_delta(delta_link, select=MIRROR_SELECT)
+        async for page, link in pages:
+            page_upserted, page_removed = await _apply_page(db, tenant.id, page, started)
+            # Commit per page so the SQLite write lock is not held across Graph paging;
+            # the delta link is only saved at the end, so an aborted round is simply redone
+            await db.commit()
+            upserted += page_upserted
+            removed += page_removed
+            if link:
+                new_delta_link = link
+    except GraphAPIError as e:
+        # 410 Gone: the delta token expired, Graph requires a fresh full round
+        if e.status == 410 and not full:
+            logger.info(f"Delta token expired for tenant {tenant.id}, running full directory sync")
+            await db.rollback()
+            return await _sync(db, tenant, full=True)
+        raise
+
+    if full:
+        # Anything not seen during a full round no longer exists in the directory
+        result = await db.execute(
+            delete(DirectoryUser)
+            .where(DirectoryUser.tenant_id == tenant.id)
+            .where(or_(DirectoryUser.synced_at < started, DirectoryUser.synced_at.is_(None)))
+        )
+        removed += result.rowcount or 0
+
+    count_result = await db.execute(
+        select(func.count(DirectoryUser.id)).where(DirectoryUser.tenant_id == tenant.id)
+    )
+    state.user_count = count_result.scalar() or 0
+    state.delta_link = new_delta_link or state.delta_link
+    state.status = "ok"
+    state.message = None
+    state.last_synced_at = started
+    if full:
+        state.last_full_sync_at = started
+    await db.commit()
+
+    logger.info(
+        f"Directory sync for tenant {tenant.id} ({'full' if full else 'delta'}): "
+        f"{upserted} upserted, {removed} removed, {state.user_count} total"
+    )
+    return {
+        "tenant_id": tenant.id,
+        "mode": "full" if full else "delta",
+        "upserted": upserted,
+        "removed": removed,
+        "user_count": state.user_count,
+        "synced_at": started,
+    }
+
+
+async def sync_tenant_users(tenant: Tenant, full: bool = False) -> Dict[str, Any]:
+    """Bring the mirror for one tenant up to date (one sync per tenant at a time)"""
+    lock = _sync_locks.setdefault(tenant.id, asyncio.Lock())
+    async with lock:
+        async with AsyncSessionLocal() as db:
+            try:
+                return await _sync(db, tenant, full)
+            except Exception as e:
+                await db.rollback()
+                state = await db.get(DirectorySyncState, tenant.id)
+                if state is None:
+                    state = DirectorySyncState(tenant_id=tenant.id)
+                    db.add(state)
+                state.status = "error"
+                state.message = str(e)[:500]
+                await db.commit()
+                raise
+
+
+async def mirror_user_changes(
+    tenant_row_id: int,
+    users: Iterable[Dict[str, Any]] = (),
+    removed: Iterable[str] = ()
+) -> None:
+    """Apply users just written through the API to the mirror, ahead of the next sync
+    
+    `users` are Graph user objects; `removed` holds object IDs or UPNs of
+    deleted users. Failures are only logged: the next sync repairs the mirror.
+    """
+    users = [user for user in users if user.get("id")]
+    removed = list(removed)
+    try:
+        async with AsyncSessionLocal() as db:
+            if removed:
+                result = await db.execute(
+                    select(DirectoryUser.object_id)
+                    .where(DirectoryUser.tenant_id == tenant_row_id)
+                    .where(or_(
+                        DirectoryUser.object_id.in_(removed),
+                        DirectoryUser.user_principal_name.in_(removed)
+                    ))
+                )
+                users += [{"id": object_id, "@removed": {}} for object_id in result.scalars().all()]
+            if users:
+                await _apply_page(db, tenant_row_id, users, datetime.utcnow())
+                await db.commit()
+    except Exception as e:
+        logger.warning(f"Failed to update directory mirror for tenant {tenant_row_id}: {e}")
+
+
+async def sync_all_tenants(full: bool = False) -> Dict[str, Any]:
+    """Sync every active tenant concurrently within the configured bound"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Tenant).where(Tenant.is_active == True))
+        tenants = result.scalars().all()
+
+    semaphore = asyncio.Semaphore(max(1, settings.directory_sync_concurrency))
+
+    async def run(tenant: Tenant) -> bool:
+        async with semaphore:
+            try:
+                await sync_tenant_users(tenant, full=full)
+                return True
+            except Exception as e:
+                logger.warning(f"Directory sync failed for tenant {tenant.id}: {e}")
+                return False
+
+    outcomes = await asyncio.gather(*(run(tenant) for tenant in tenants))
+    return {"tenants": len(tenants), "failed": outcomes.count(False)}
@@ -1,76 +1,380 @@
+import asyncio
+import logging
 import aiohttp
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 from app.services.msal_service import MSALService
+from app.services.http_session import get_http_session
+from app.services.retry_policy import RetryPolicy, default_retry_policy, request_stats
+from app.services.throttle import tenant_limiters
+from app.services.circuit_breaker import circuit_breakers, CircuitOpenError
 from app.config import get_settings
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Graph caps $top at 999 for directory objects
+GRAPH_MAX_PAGE_SIZE = 999
+
+# JSON $batch accepts at most 20 sub-requests per call
+GRAPH_BATCH_MAX_REQUESTS = 20
+
+
+# Usage report downloads are streamed in chunks of this size
+REPORT_CHUNK_SIZE = 64 * 1024
+
+REPORT_TIMEOUT = aiohttp.ClientTimeout(
+    total=None,
+    connect=settings.graph_http_connect_timeout,
+    sock_read=settings.graph_http_timeout
+)
+
+# Password credential created by secret rotation
+NEW_PASSWORD_CREDENTIAL = {
+    "displayName": "O365 Manager Auto-Generated Secret",
+    "endDateTime": "2099-12-31T23:59:59Z"
+}
+
+# Projections for reads that have no response model (the frontend consumes raw Graph objects)
+ROLE_SELECT_FIELDS = ["id", "displayName", "description", "roleTemplateId"]
+ROLE_MEMBER_SELECT_FIELDS = ["id", "displayName", "userPrincipalName", "mail"]
+
+# $count and advanced $filter queries on directory objects require eventual consistency
+EVENTUAL_CONSISTENCY = {"ConsistencyLevel": "eventual"}
+
+# User breakdowns reported by get_user_counts (in addition to the total)
+USER_COUNT_FILTERS = {
+    "enabled": "accountEnabled eq true",
+    "disabled": "accountEnabled eq false",
+    "guests": "userType eq 'Guest'",
+}
+
+
+def clamp_page_size(page_size: int) -> int:
+    return max(1, min(page_size, GRAPH_MAX_PAGE_SIZE))
+
+
+def select_params(select: Optional[List[str]], params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Add a $select projection to query parameters"""
+    if not select:
+        return params
+    params = dict(params or {})
+    params["$select"] = ",".join(select)
+    return params
+
+
+class GraphAPIError(Exception):
+    """Graph returned an error status; the message keeps the legacy "Graph API error: ..." format"""
+    
+    def __init__(self, status: int, detail: Any, retry_after: Optional[float] = None):
+        super().__init__(f"Graph API error: {status} - {detail}")
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
 
 class GraphAPIService:
-    def __init__(self, msal_service: MSALService):
+    def __init__(
+        self,
+        msal_service: MSALService,
+        session: Optional[aiohttp.ClientSession] = None,
+        retry_policy: Optional[RetryPolicy] = None
+    ):
         self.msal_service = msal_service
         self.base_url = settings.graph_api_endpoint
-        self._token = None
+        self._session = session
+        self.retry_policy = retry_policy or default_retry_policy
     
-    def get_headers(self) -> Dict[str, str]:
-        if not self._token:
-            self._token = self.msal_service.get_access_token()
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Pooled HTTP session (process-wide unless one was injected)"""
+        if self._session is not None and not self._session.closed:
+            return self._session
+        return get_http_session()
+    
+    async def get_headers(self, force_refresh: bool = False) -> Dict[str, str]:
+        token = await self.msal_service.get_access_token_async(force_refresh=force_refresh)
         
         return {
-            "Authorization": f"Bearer {self._token}",
+            "Authorization": f"Bearer {token}",
             "Content-Type": "application/json"
         }
     
+    @property
+    def stats(self):
+        return request_stats.for_tenant(self.msal_service.tenant_id)
+    
     async def _make_request(
         self,
         method: str,
         endpoint: str,
         data: Optional[Dict[str, Any]] = None,
-        params: Optional[Dict[str, Any]] = None
-    ) -> Dict[str, Any]:
-        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        stream: bool = False
+    ) -> Any:
+        """
+        Send a Graph request through the tenant's breaker, limiter and retry policy.
         
-        async with aiohttp.ClientSession() as session:
-            async with session.request(
-                method=method,
-                url=url,
-                headers=self.get_headers(),
-                json=data,
-                params=params
-            ) as response:
-                if response.status == 401:
-                    self._token = None
-                    return await self._make_request(method, endpoint, data, params)
-                
-                # Handle 204 No Content (successful deletion)
-                if response.status == 204:
-                    return {"success": True}
-                
-                # Try to parse JSON response
-                try:
-                    response_data = await response.json()
-                except Exception:
-                    # If not JSON, return empty dict for successful responses
-                    if 200 <= response.status < 300:
-                        return {"success": True}
-                    else:
-                        raise Exception(f"Graph API error: {response.status} - Non-JSON response")
-                
-                if response.status >= 400:
-                    raise Exception(f"Graph API error: {response.status} - {response_data}")
-                
-                return response_data
+        With stream=True redirects are not followed and a non-error response is
+        returned unread: the caller must consume or release it.
+        """
+        # Fail fast (before any token or HTTP work) while the tenant's circuit is open
+        breaker = circuit_breakers.get(self.msal_service.tenant_id)
+        breaker.check()
+        try:
+            result = await self._send_request(method, endpoint, data, params, headers, stream)
+        except Exception as e:
+            breaker.record_failure(e)
+            raise
+        breaker.record_success()
+        return result
     
-    async def get_users(self, filter_query: Optional[str] = None, top: int = 100) -> List[Dict[str, Any]]:
-        params = {"$top": top}
+    async def _send_request(
+        self,
+        method: str,
+        endpoint: str,
+        data: Optional[Dict[str, Any]],
+        params: Optional[Dict[str, Any]],
+        headers: Optional[Dict[str, str]],
+        stream: bool = False
+    ) -> Any:
+        # @odata.nextLink values are absolute URLs
+        if endpoint.startswith("https://") or endpoint.startswith("http://"):
+            url = endpoint
+        else:
+            url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        
+        policy = self.retry_policy
+        stats = self.stats
+        limiter = tenant_limiters.get(self.msal_service.tenant_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + policy.deadline
+        token_refreshed = False
+        refresh_token = False
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            stats.requests += 1
+            if deadline - loop.time() <= 0:
+                stats.deadline_exceeded += 1
+                raise Exception(f"Graph API error: request deadline of {policy.deadline:.0f}s exceeded (timed out)")
+            
+            request_headers = await self.get_headers(force_refresh=refresh_token)
+            if headers:
+                request_headers.update(headers)
+            if stream:
+                # No total timeout: large reports may take a while, but a stalled read still fails
+                timeout = REPORT_TIMEOUT
+            else:
+                timeout = aiohttp.ClientTimeout(total=max(deadline - loop.time(), 0.001))
+            try:
+                async with limiter.slot() as slot:
+                    response = await self.session.request(
+                        method=method,
+                        url=url,
+                        headers=request_headers,
+                        json=data,
+                        params=params,
+                        timeout=timeout,
+                        allow_redirects=not stream
+                    )
+                    handed_over = False
+                    try:
+                        slot.status = response.status
+                        
+                        # A single forced token refresh per call; a second 401 is a real auth failure
+                        if response.status == 401 and not token_refreshed:
+                            token_refreshed = refresh_token = True
+                            stats.token_refreshes += 1
+                            continue
+                        refresh_token = False
+                        
+                        if not policy.should_retry_status(method, response.status):
+                            if stream and response.status < 400:
+                                handed_over = True
+                                return response
+                            return await self._parse_response(response)
+                        
+                        retry_after = policy.retry_after(response.headers)
+                        delay = retry_after if retry_after is not None else policy.backoff(attempt)
+                        try:
+                            detail = await response.json()
+                        except Exception:
+                            detail = "Non-JSON response"
+                        error: Exception = GraphAPIError(response.status, detail, retry_after)
+                        throttled = response.status == 429
+                        if retry_after is not None:
+                            # Graph throttles per tenant, so hold back every caller for this tenant
+                            limiter.pause(retry_after)
+                    finally:
+                        if not handed_over:
+                            response.release()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if not policy.should_retry_connection_error(method):
+                    raise
+                delay = policy.backoff(attempt)
+                error = e
+                throttled = False
+            
+            if attempt >= policy.max_attempts:
+                raise error
+            if loop.time() + delay >= deadline:
+                stats.deadline_exceeded += 1
+                raise error
+            
+            stats.record_retry(delay, throttled=throttled)
+            logger.debug(
+                f"Retrying {method} {endpoint} for tenant {self.msal_service.tenant_id} "
+                f"in {delay:.2f}s (attempt {attempt}/{policy.max_attempts}): {error}"
+            )
+            await asyncio.sleep(delay)
+    
+    async def _parse_response(self, response: aiohttp.ClientResponse) -> Dict[str, Any]:
+        # Handle 204 No Content (successful deletion)
+        if response.status == 204:
+            return {"success": True}
+        
+        # $count endpoints answer with a bare number
+        if response.content_type == "text/plain" and 200 <= response.status < 300:
+            return {"value": await response.text()}
+        
+        # Try to parse JSON response
+        try:
+            response_data = await response.json()
+        except Exception:
+            # If not JSON, return empty dict for successful responses
+            if 200 <= response.status < 300:
+                return {"success": True}
+            else:
+                raise GraphAPIError(response.status, "Non-JSON response")
+        
+        if response.status >= 400:
+            raise GraphAPIError(response.status, response_data)
+        
+        return response_data
+    
+    async def iter_pages(
+        self,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None,
+        max_items: Optional[int] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield collection pages, following @odata.nextLink until exhausted
+        or until max_items have been yielded.
+        """
+        remaining = max_items
+        result = await self._make_request("GET", endpoint, params=params)
+        
+        while True:
+            items = result.get("value", [])
+            if remaining is not None:
+                items = items[:remaining]
+                remaining -= len(items)
+            if items:
+                yield items
+            
+            next_link = result.get("@odata.nextLink")
+            if not next_link or (remaining is not None and remaining <= 0):
+                return
+            # nextLink already carries the original query parameters
+            result = await self._make_request("GET", next_link)
+    
+    async def iter_items(
+        self,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None,
+        max_items: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        async for page in self.iter_pages(endpoint, params=params, max_items=max_items):
+            for item in page:
+                yield item
+    
+    async def collect(
+        self,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None,
+        max_items: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        items: List[Dict[str, Any]] = []
+        async for page in self.iter_pages(endpoint, params=params, max_items=max_items):
+            items.extend(page)
+        return items
+    
+    def iter_users(
+        self,
+        filter_query: Optional[str] = None,
+        page_size: int = 100,
+        max_items: Optional[int] = None,
+        select: Optional[List[str]] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        params: Dict[str, Any] = {"$top": clamp_page_size(page_size)}
         if filter_query:
             params["$filter"] = filter_query
+        return self.iter_pages("/users", params=select_params(select, params), max_items=max_items)
+    
+    async def iter_delta(
+        self,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Tuple[List[Dict[str, Any]], Optional[str]]]:
+        """
+        Yield (page, delta_link) for a delta query. delta_link is only set on the
+        final page and should be stored to request the next round of changes.
+        """
+        result = await self._make_request("GET", endpoint, params=params)
         
-        result = await self._make_request("GET", "/users", params=params)
-        return result.get("value", [])
+        while True:
+            next_link = result.get("@odata.nextLink")
+            delta_link = None if next_link else result.get("@odata.deltaLink")
+            yield result.get("value", []), delta_link
+            
+            if not next_link:
+                return
+            result = await self._make_request("GET", next_link)
+    
+    def iter_users_delta(
+        self,
+        delta_link: Optional[str] = None,
+        select: Optional[List[str]] = None
+    ) -> AsyncIterator[Tuple[List[Dict[str, Any]], Optional[str]]]:
+        if delta_link:
+            return self.iter_delta(delta_link)
+        return self.iter_delta("/users/delta", params=select_params(select))
+    
+    async def get_users(
+        self,
+        filter_query: Optional[str] = None,
+        top: int = 100,
+        select: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        users: List[Dict[str, Any]] = []
+        async for page in self.iter_users(filter_query=filter_query, page_size=top, max_items=top, select=select):
+            users.extend(page)
+        return users
     
-    async def get_user(self, user_id: str) -> Dict[str, Any]:
-        return await self._make_request("GET", f"/users/{user_id}")
+    async def count(self, endpoint: str, filter_query: Optional[str] = None) -> int:
+        """Server-side object count via `{endpoint}/$count` (no listing)"""
+        params = {"$filter": filter_query} if filter_query else None
+        result = await self._make_request(
+            "GET", f"{endpoint.rstrip('/')}/$count", params=params, headers=EVENTUAL_CONSISTENCY
+        )
+        return int(result["value"])
+    
+    async def count_users(self, filter_query: Optional[str] = None) -> int:
+        return await self.count("/users", filter_query)
+    
+    async def get_user_counts(self) -> Dict[str, int]:
+        """Total, enabled, disabled and guest users: four tiny $count requests"""
+        totals = await asyncio.gather(
+            self.count_users(),
+            *(self.count_users(filter_query) for filter_query in USER_COUNT_FILTERS.values())
+        )
+        return dict(zip(["total", *USER_COUNT_FILTERS], totals))
+    
+    async def get_user(self, user_id: str, select: Optional[List[str]] = None) -> Dict[str, Any]:
+        return await self._make_request("GET", f"/users/{user_id}", params=select_params(select))
     
     async def create_user(self, user_data: Dict[str, Any]) -> Dict[str, Any]:
         return await self._make_request("POST", "/users", data=user_data)
@@ -87,12 +391,11 @@ class GraphAPIService:
     async def disable_user(self, user_id: str) -> Dict[str, Any]:
         return await self.update_user(user_id, {"accountEnabled": False})
     
-    async def get_domains(self) -> List[Dict[str, Any]]:
-        result = await self._make_request("GET", "/domains")
-        return result.get("value", [])
+    async def get_domains(self, select: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return await self.collect("/domains", params=select_params(select))
     
-    async def get_domain(self, domain_id: str) -> Dict[str, Any]:
-        return await self._make_request("GET", f"/domains/{domain_id}")
+    async def get_domain(self, domain_id: str, select: Optional[List[str]] = None) -> Dict[str, Any]:
+        return await self._make_request("GET", f"/domains/{domain_id}", params=select_params(select))
     
     async def create_domain(self, domain_name: str) -> Dict[str, Any]:
         return await self._make_request("POST", "/domains", data={"id": domain_name})
@@ -104,16 +407,49 @@ class GraphAPIService:
         return await self._make_request("POST", f"/domains/{domain_id}/verify")
     
     async def get_subscribed_skus(self) -> List[Dict[str, Any]]:
-        result = await self._make_request("GET", "/subscribedSkus")
-        return result.get("value", [])
+        return await self.collect("/subscribedSkus")
+    
+    async def get_directory_roles(self, select: Optional[List[str]] = ROLE_SELECT_FIELDS) -> List[Dict[str, Any]]:
+        return await self.collect("/directoryRoles", params=select_params(select))
     
-    async def get_directory_roles(self) -> List[Dict[str, Any]]:
-        result = await self._make_request("GET", "/directoryRoles")
-        return result.get("value", [])
+    def iter_role_members(
+        self,
+        role_id: str,
+        page_size: int = 100,
+        max_items: Optional[int] = None,
+        select: Optional[List[str]] = ROLE_MEMBER_SELECT_FIELDS
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        params = select_params(select, {"$top": clamp_page_size(page_size)})
+        return self.iter_pages(f"/directoryRoles/{role_id}/members", params=params, max_items=max_items)
     
-    async def get_directory_role_members(self, role_id: str) -> List[Dict[str, Any]]:
-        result = await self._make_request("GET", f"/directoryRoles/{role_id}/members")
-        return result.get("value", [])
+    async def get_directory_role_members(
+        self,
+        role_id: str,
+        select: Optional[List[str]] = ROLE_MEMBER_SELECT_FIELDS
+    ) -> List[Dict[str, Any]]:
+        members: List[Dict[str, Any]] = []
+        async for page in self.iter_role_members(role_id, page_size=GRAPH_MAX_PAGE_SIZE, select=select):
+            members.extend(page)
+        return members
+    
+    async def count_role_members(self, role_ids: List[str]) -> Dict[str, Optional[int]]:
+        """Member count per activated directory role, via $batch (None if a role failed)"""
+        results = await self.batch([
+            {
+                "method": "GET",
+                "url": f"/directoryRoles/{role_id}/members?$select=id&$top={GRAPH_MAX_PAGE_SIZE}&$count=true",
+                "headers": EVENTUAL_CONSISTENCY,
+            }
+            for role_id in role_ids
+        ])
+        counts: Dict[str, Optional[int]] = {}
+        for role_id, result in zip(role_ids, results):
+            if not result["success"]:
+                counts[role_id] = None
+                continue
+            data = result["data"] or {}
+            counts[role_id] = data.get("@odata.count", len(data.get("value", [])))
+        return counts
     
     async def add_directory_role_member(self, role_id: str, user_id: str) -> None:
         data = {
@@ -129,38 +465,181 @@ class GraphAPIService:
         orgs = result.get("value", [])
         return orgs[0] if orgs else {}
     
-    async def get_onedrive_usage_report(self, period: str = "D7") -> bytes:
-        endpoint = f"/reports/getOneDriveUsageAccountDetail(period='{period}')"
-        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+    async def open_report(self, endpoint: str, report_name: str) -> aiohttp.ClientResponse:
+        """
+        Start a usage report download without buffering it.
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self.get_headers()) as response:
-                if response.status >= 400:
-                    raise Exception(f"Failed to get OneDrive report: {response.status}")
-                return await response.read()
+        Graph answers report requests with a redirect to a pre-authenticated
+        download URL, which is fetched without our bearer token. The caller must
+        consume the returned response with iter_content() or release it.
+        """
+        response = await self._make_request("GET", endpoint, stream=True)
+        if response.status in (301, 302, 303, 307, 308):
+            location = response.headers.get("Location")
+            response.release()
+            if not location:
+                raise Exception(f"Failed to get {report_name} report: {response.status} without Location")
+            response = await self.session.get(location, timeout=REPORT_TIMEOUT)
+            if response.status >= 400:
+                response.release()
+                raise Exception(f"Failed to get {report_name} report: {response.status}")
+        return response
     
-    async def get_exchange_usage_report(self, period: str = "D7") -> bytes:
+    @staticmethod
+    async def iter_content(
+        response: aiohttp.ClientResponse,
+        chunk_size: int = REPORT_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """Yield the body chunk by chunk; reading only resumes once the consumer asks for more"""
+        try:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            response.release()
+    
+    @staticmethod
+    async def release_content(response: aiohttp.ClientResponse) -> None:
+        """Return the connection to the pool, also when iter_content() never ran"""
+        response.release()
+    
+    async def open_onedrive_usage_report(self, period: str = "D7") -> aiohttp.ClientResponse:
+        endpoint = f"/reports/getOneDriveUsageAccountDetail(period='{period}')"
+        return await self.open_report(endpoint, "OneDrive")
+    
+    async def open_exchange_usage_report(self, period: str = "D7") -> aiohttp.ClientResponse:
         endpoint = f"/reports/getMailboxUsageDetail(period='{period}')"
-        url = f"{self.base_url}/{endpoint.lstrip('/')}"
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=self.get_headers()) as response:
-                if response.status >= 400:
-                    raise Exception(f"Failed to get Exchange report: {response.status}")
-                return await response.read()
+        return await self.open_report(endpoint, "Exchange")
+    
+    async def get_onedrive_usage_report(self, period: str = "D7") -> bytes:
+        response = await self.open_onedrive_usage_report(period)
+        return b"".join([chunk async for chunk in self.iter_content(response)])
+    
+    async def get_exchange_usage_report(self, period: str = "D7") -> bytes:
+        response = await self.open_exchange_usage_report(period)
+        return b"".join([chunk async for chunk in self.iter_content(response)])
     
-    async def search_users(self, keyword: str) -> List[Dict[str, Any]]:
+    async def search_users(
+        self,
+        keyword: str,
+        select: Optional[List[str]] = None,
+        top: int = 100
+    ) -> List[Dict[str, Any]]:
+        # OData string literals escape a quote by doubling it
+        keyword = keyword.replace("'", "''")
         filter_query = f"startswith(displayName,'{keyword}') or startswith(userPrincipalName,'{keyword}')"
-        return await self.get_users(filter_query=filter_query)
+        return await self.get_users(filter_query=filter_query, top=top, select=select)
+    
+    async def batch(
+        self,
+        requests: List[Dict[str, Any]],
+        concurrency: int = settings.graph_batch_concurrency,
+        max_retries: int = settings.graph_batch_max_retries
+    ) -> List[Dict[str, Any]]:
+        """
+        Execute sub-requests through Graph JSON $batch.
+        
+        Args:
+            requests: [{"method": str, "url": str, "body": dict (optional),
+                      "headers": dict (optional)}], url relative to the API version
+                      (e.g. "/users")
+            concurrency: Maximum number of $batch calls in flight
+            max_retries: Extra rounds for throttled / transient sub-request failures
+            
+        Returns: One {"success": bool, "status": int|None, "data"|"error": ...} per
+                 request, in input order
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+        pending = list(range(len(requests)))
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        for attempt in range(max_retries + 1):
+            retry: List[int] = []
+            retry_after: Optional[float] = None
+            
+            async def run_chunk(chunk: List[int]) -> None:
+                nonlocal retry_after
+                sub_requests = []
+                for index in chunk:
+                    request = requests[index]
+                    sub_request = {
+                        "id": str(index),
+                        "method": request["method"],
+                        "url": "/" + request["url"].lstrip("/"),
+                    }
+                    if request.get("body") is not None:
+                        sub_request["body"] = request["body"]
+                        sub_request["headers"] = {"Content-Type": "application/json"}
+                    if request.get("headers"):
+                        sub_request["headers"] = {**sub_request.get("headers", {}), **request["headers"]}
+                    sub_requests.append(sub_request)
+                
+                async with semaphore:
+                    try:
+                        response = await self._make_request("POST", "/$batch", data={"requests": sub_requests})
+                    except Exception as e:
+                        # The whole call failed; sub-requests may or may not have run, so don't resubmit
+                        for index in chunk:
+                            results[index] = {"success": False, "status": None, "error": str(e)}
+                        return
+                
+                answered = set()
+                for sub_response in response.get("responses", []):
+                    index = int(sub_response["id"])
+                    answered.add(index)
+                    status = sub_response.get("status", 0)
+                    body = sub_response.get("body")
+                    
+                    if 200 <= status < 300:
+                        results[index] = {"success": True, "status": status, "data": body}
+                        continue
+                    
+                    results[index] = {
+                        "success": False,
+                        "status": status,
+                        "error": f"Graph API error: {status} - {body}"
+                    }
+                    # Same rule as single requests: a 500/502/504 POST may already have run
+                    if self.retry_policy.should_retry_status(requests[index]["method"], status):
+                        retry.append(index)
+                        sub_retry_after = self.retry_policy.retry_after(sub_response.get("headers") or {})
+                        if sub_retry_after is not None:
+                            retry_after = max(retry_after or 0.0, sub_retry_after)
+                
+                for index in chunk:
+                    if index not in answered:
+                        results[index] = {"success": False, "status": None, "error": "Missing $batch response"}
+            
+            chunks = [
+                pending[i:i + GRAPH_BATCH_MAX_REQUESTS]
+                for i in range(0, len(pending), GRAPH_BATCH_MAX_REQUESTS)
+            ]
+            await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+            
+            if not retry or attempt == max_retries:
+                break
+            
+            pending = sorted(retry)
+            # Same as _send_request: honour Retry-After (even 0), otherwise full-jitter backoff
+            delay = retry_after if retry_after is not None else self.retry_policy.backoff(attempt + 1)
+            if retry_after is not None:
+                tenant_limiters.get(self.msal_service.tenant_id).pause(retry_after)
+            logger.info(f"Retrying {len(pending)} throttled/failed $batch sub-requests in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        
+        return results
     
     async def batch_create_users(self, users_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        batch_results = await self.batch([
+            {"method": "POST", "url": "/users", "body": user_data}
+            for user_data in users_data
+        ])
+        
         results = []
-        for user_data in users_data:
-            try:
-                result = await self.create_user(user_data)
-                results.append({"success": True, "data": result})
-            except Exception as e:
-                results.append({"success": False, "error": str(e), "data": user_data})
+        for user_data, result in zip(users_data, batch_results):
+            if result["success"]:
+                results.append({"success": True, "data": result["data"]})
+            else:
+                results.append({"success": False, "error": result["error"], "data": user_data})
         return results
     
     async def check_spo_status(self) -> Dict[str, Any]:
@@ -168,47 +647,69 @@ class GraphAPIService:
         Check SharePoint Online status by accessing site root drive permissions
         Returns: {"status": "available"|"unavailable"|"no_subscription"|"unknown", "message": str}
         """
-        endpoint = "/sites/root/drive/root/permissions"
-        url = f"{self.base_url}/{endpoint.lstrip('/')}"
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url, headers=self.get_headers()) as response:
-                    status_code = response.status
-                    
-                    if status_code == 200:
-                        data = await response.json()
-                        value = data.get("value", [])
-                        if len(value) > 0:
-                            return {
-                                "status": "available",
-                                "message": "SharePoint Online 可用"
-                            }
-                        else:
-                            return {
-                                "status": "unavailable",
-                                "message": "SharePoint Online 不可用"
-                            }
-                    elif status_code == 400:
-                        return {
-                            "status": "no_subscription",
-                            "message": "无 SharePoint Online 订阅"
-                        }
-                    elif status_code in [404, 429, 502]:
-                        return {
-                            "status": "unavailable",
-                            "message": "SharePoint Online 不可用"
-                        }
-                    else:
-                        return {
-                            "status": "unknown",
-                            "message": f"未知状态 (HTTP {status_code})"
-                        }
-            except Exception as e:
+        try:
+            # Through _make_request so the probe counts towards the tenant's circuit breaker
+            data = await self._make_request("GET", "/sites/root/drive/root/permissions")
+            if len(data.get("value", [])) > 0:
                 return {
-                    "status": "error",
-                    "message": f"检查失败: {str(e)}"
+                    "status": "available",
+                    "message": "SharePoint Online 可用"
                 }
+            else:
+                return {
+                    "status": "unavailable",
+                    "message": "SharePoint Online 不可用"
+                }
+        except GraphAPIError as e:
+            if e.status == 400:
+                return {
+                    "status": "no_subscription",
+                    "message": "无 SharePoint Online 订阅"
+                }
+            elif e.status in [404, 429, 502]:
+                return {
+                    "status": "unavailable",
+                    "message": "SharePoint Online 不可用"
+                }
+            else:
+                return {
+                    "status": "unknown",
+                    "message": f"未知状态 (HTTP {e.status})"
+                }
+        except CircuitOpenError:
+            # Nothing was checked: callers must not record this as the tenant's status
+            raise
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"检查失败: {str(e)}"
+            }
+    
+    async def get_application(self, application_id: str) -> Dict[str, Any]:
+        """Application object (with its passwordCredentials) for a client_id (appId)"""
+        apps_result = await self._make_request(
+            "GET", "/applications",
+            params={"$filter": f"appId eq '{application_id}'", "$select": "id,appId,passwordCredentials"}
+        )
+        apps = apps_result.get("value", [])
+        if not apps:
+            raise Exception(f"Application with client_id {application_id} not found")
+        return apps[0]
+    
+    async def add_client_secret(self, app_object_id: str) -> Dict[str, Any]:
+        """Add a password credential; the response carries secretText, keyId and endDateTime"""
+        return await self._make_request(
+            "POST",
+            f"/applications/{app_object_id}/addPassword",
+            data={"passwordCredential": dict(NEW_PASSWORD_CREDENTIAL)}
+        )
+    
+    async def remove_client_secret(self, app_object_id: str, key_id: str) -> None:
+        await self._make_request(
+            "POST",
+            f"/applications/{app_object_id}/removePassword",
+            data={"keyId": key_id}
+        )
     
     async def update_client_secret(self, application_id: str, delete_old_secret: bool = False) -> Dict[str, Any]:
         """
@@ -225,31 +726,16 @@ class GraphAPIService:
         
         try:
             # First, get the application object by appId (client_id)
-            filter_query = f"appId eq '{application_id}'"
-            apps_result = await self._make_request("GET", "/applications", params={"$filter": filter_query})
-            apps = apps_result.get("value", [])
-            
-            if not apps or len(apps) == 0:
-                raise Exception(f"Application with client_id {application_id} not found")
-            
-            app_object_id = apps[0]["id"]
+            application = await self.get_application(application_id)
+            app_object_id = application["id"]
             
             # Save the first existing credential's keyId BEFORE creating new one
             # This is assumed to be the currently used credential
-            existing_credentials = apps[0].get("passwordCredentials", [])
+            existing_credentials = application.get("passwordCredentials", [])
             old_key_to_delete = existing_credentials[0].get("keyId") if existing_credentials else None
             
             # Add new password credential with expiry date 2099-12-31
-            password_credential = {
-                "displayName": "O365 Manager Auto-Generated Secret",
-                "endDateTime": "2099-12-31T23:59:59Z"
-            }
-            
-            result = await self._make_request(
-                "POST",
-                f"/applications/{app_object_id}/addPassword",
-                data={"passwordCredential": password_credential}
-            )
+            result = await self.add_client_secret(app_object_id)
             
             new_key_id = result.get("keyId")
             
@@ -267,11 +753,7 @@ class GraphAPIService:
 
                     for attempt in range(max_retries):
                         try:
-                            await self._make_request(
-                                "POST",
-                                f"/applications/{app_object_id}/removePassword",
-                                data={"keyId": old_key_to_delete}
-                            )
+                            await self.remove_client_secret(app_object_id, old_key_to_delete)
                             print(f"Successfully deleted old credential {old_key_to_delete}")
                             deletion_msg = " (已删除旧密钥)"
                             break
@@ -0,0 +1,60 @@
+"""
+Shared aiohttp session
+
+A single pooled ClientSession is reused by every GraphAPIService so that
+DNS lookups, TCP connections and TLS handshakes to graph.microsoft.com are
+paid once per connection instead of once per request.
+"""
+
+import aiohttp
+from typing import Optional
+from app.config import get_settings
+
+settings = get_settings()
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=settings.graph_http_limit,
+        limit_per_host=settings.graph_http_limit_per_host,
+        keepalive_timeout=settings.graph_http_keepalive_timeout,
+        use_dns_cache=True,
+        ttl_dns_cache=settings.graph_http_dns_cache_ttl,
+        enable_cleanup_closed=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=settings.graph_http_timeout,
+        connect=settings.graph_http_connect_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def init_http_session() -> aiohttp.ClientSession:
+    """Create the process-wide session (called from the app lifespan)"""
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+
+async def close_http_session() -> None:
+    """Close the process-wide session and release pooled connections"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Return the shared session.
+
+    Created lazily when used outside the app lifespan (scripts, shells),
+    so it must be called from within a running event loop.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
@@ -0,0 +1,215 @@
+"""
+License cache helpers
+
+Shared by the license routes and background jobs: turning Graph
+subscribedSkus into O365LicenseResponse objects, reading LicenseCache for
+many tenants in one query and refreshing a tenant's cache from Graph with
+an upsert that only writes rows whose values changed. Each refresh also
+records a usage history sample.
+"""
+
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Any
+from sqlalchemy import select, insert, update, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_settings
+from app.models import LicenseCache, Tenant
+from app.schemas import O365LicenseResponse
+from app.services.graph_service import GraphAPIService
+from app.services.license_history import record_license_usage
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Cache expiry time in hours
+CACHE_EXPIRY_HOURS = settings.license_cache_ttl_hours
+
+# Load SKU mapping
+SKU_MAP_PATH = Path(__file__).parent.parent / "sku_map.json"
+try:
+    with open(SKU_MAP_PATH, "r", encoding="utf-8") as f:
+        SKU_MAP = json.load(f)
+except Exception as e:
+    print(f"Warning: Failed to load sku_map.json: {e}")
+    SKU_MAP = {}
+
+
+def get_sku_name_cn(sku_part_number: str) -> str:
+    """Get Chinese name for SKU, fallback to SKU part number if not found"""
+    return SKU_MAP.get(sku_part_number, sku_part_number)
+
+
+def sku_to_license(sku: Dict[str, Any]) -> O365LicenseResponse:
+    prepaid_units = sku.get("prepaidUnits", {})
+    sku_part_number = sku.get("skuPartNumber")
+    consumed_units = sku.get("consumedUnits", 0)
+    enabled_units = prepaid_units.get("enabled", 0)
+
+    # 尝试获取过期时间（如果存在）
+    expires_at = None
+    if "nextLifecycleDateTime" in sku and sku["nextLifecycleDateTime"]:
+        try:
+            expires_at = datetime.fromisoformat(sku["nextLifecycleDateTime"].replace('Z', '+00:00'))
+        except Exception as e:
+            logger.warning(f"Failed to parse nextLifecycleDateTime for {sku_part_number}: {e}")
+
+    return O365LicenseResponse(
+        sku_id=sku.get("skuId"),
+        sku_part_number=sku_part_number,
+        sku_name_cn=get_sku_name_cn(sku_part_number),
+        consumed_units=consumed_units,
+        enabled_units=enabled_units,
+        available_units=enabled_units - consumed_units,
+        expires_at=expires_at
+    )
+
+
+def cache_row_to_license(cache: LicenseCache) -> O365LicenseResponse:
+    return O365LicenseResponse(
+        sku_id=cache.sku_id,
+        sku_part_number=cache.sku_part_number,
+        sku_name_cn=cache.sku_name_cn,
+        consumed_units=cache.consumed_units,
+        enabled_units=cache.enabled_units,
+        available_units=cache.available_units,
+        expires_at=cache.expires_at
+    )
+
+
+def tenant_cache_ttl(tenant: Tenant) -> timedelta:
+    """How long a tenant's license cache counts as fresh"""
+    if tenant.license_refresh_minutes:
+        return timedelta(minutes=tenant.license_refresh_minutes)
+    return timedelta(hours=CACHE_EXPIRY_HOURS)
+
+
+def is_cache_stale(tenant: Tenant, cached_at: Optional[datetime]) -> bool:
+    return cached_at is None or cached_at <= datetime.utcnow() - tenant_cache_ttl(tenant)
+
+
+async def read_cached_licenses(
+    db: AsyncSession,
+    tenant_ids: Optional[Iterable[int]] = None
+) -> Dict[int, List[LicenseCache]]:
+    """All cached license rows grouped by tenant, in a single query"""
+    query = select(LicenseCache)
+    if tenant_ids is not None:
+        query = query.where(LicenseCache.tenant_id.in_(list(tenant_ids)))
+    result = await db.execute(query)
+
+    grouped: Dict[int, List[LicenseCache]] = defaultdict(list)
+    for row in result.scalars().all():
+        grouped[row.tenant_id].append(row)
+    return grouped
+
+
+# Columns compared to decide whether a cached row changed
+LICENSE_FIELDS = (
+    "sku_part_number", "sku_name_cn", "consumed_units", "enabled_units", "available_units", "expires_at"
+)
+
+
+def _comparable(value: Any) -> Any:
+    # Timestamps come back from SQLite naive (UTC) but are parsed from Graph as aware
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _upsert_statement(dialect_name: str):
+    """INSERT .. ON CONFLICT (tenant_id, sku_id) DO UPDATE, or None if the dialect lacks it"""
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    statement = dialect_insert(LicenseCache)
+    return statement.on_conflict_do_update(
+        index_elements=["tenant_id", "sku_id"],
+        set_={
+            **{field: statement.excluded[field] for field in LICENSE_FIELDS},
+            "cached_at": statement.excluded.cached_at,
+            "updated_at": func.now(),
+        },
+    )
+
+
+async def save_tenant_licenses(
+    db: AsyncSession,
+    tenant_id: int,
+    licenses: List[O365LicenseResponse]
+) -> Dict[str, int]:
+    """Write a tenant's licenses to the cache, touching as few rows as possible
+    
+    New and changed SKUs go through one bulk upsert (an update plus an insert
+    on dialects without ON CONFLICT), unchanged rows only get
+    their cached_at bumped and SKUs Graph no longer returns are deleted.
+    Does not commit.
+    """
+    now = datetime.utcnow()
+    result = await db.execute(
+        select(LicenseCache.sku_id, LicenseCache.id, *(getattr(LicenseCache, field) for field in LICENSE_FIELDS))
+        .where(LicenseCache.tenant_id == tenant_id)
+    )
+    rows = result.all()
+    existing = {row[0]: tuple(_comparable(value) for value in row[2:]) for row in rows}
+    row_ids = {row[0]: row[1] for row in rows}
+
+    upserts: List[Dict[str, Any]] = []
+    unchanged: List[str] = []
+    for license in licenses:
+        values = {field: getattr(license, field) for field in LICENSE_FIELDS}
+        if existing.get(license.sku_id) == tuple(_comparable(values[field]) for field in LICENSE_FIELDS):
+            unchanged.append(license.sku_id)
+        else:
+            upserts.append({"tenant_id": tenant_id, "sku_id": license.sku_id, **values, "cached_at": now})
+    vanished = set(existing) - {license.sku_id for license in licenses}
+
+    if upserts:
+        statement = _upsert_statement(db.bind.dialect.name)
+        if statement is not None:
+            await db.execute(statement, upserts)
+        else:
+            # No ON CONFLICT: update the rows read above by primary key, insert the rest
+            updates = [{"id": row_ids[row["sku_id"]], **row} for row in upserts if row["sku_id"] in row_ids]
+            inserts = [row for row in upserts if row["sku_id"] not in row_ids]
+            if updates:
+                await db.execute(update(LicenseCache), updates)
+            if inserts:
+                await db.execute(insert(LicenseCache), inserts)
+    if unchanged:
+        await db.execute(
+            update(LicenseCache)
+            .where(LicenseCache.tenant_id == tenant_id, LicenseCache.sku_id.in_(unchanged))
+            # Keep updated_at meaning "values last changed" (it has an onupdate)
+            .values(cached_at=now, updated_at=LicenseCache.updated_at)
+        )
+    if vanished:
+        await db.execute(
+            delete(LicenseCache)
+            .where(LicenseCache.tenant_id == tenant_id, LicenseCache.sku_id.in_(vanished))
+        )
+    return {"upserted": len(upserts), "unchanged": len(unchanged), "deleted": len(vanished)}
+
+
+async def refresh_tenant_licenses(
+    db: AsyncSession,
+    tenant_id: int,
+    graph_service: GraphAPIService
+) -> List[O365LicenseResponse]:
+    """Fetch subscribed SKUs from Graph and sync the tenant's cache rows"""
+    logger.debug(f"Calling Microsoft Graph API for tenant {tenant_id}")
+    skus = await graph_service.get_subscribed_skus()
+    logger.debug(f"Received {len(skus)} SKUs from Graph API")
+
+    licenses = [sku_to_license(sku) for sku in skus]
+    counts = await save_tenant_licenses(db, tenant_id, licenses)
+    await record_license_usage(db, tenant_id, licenses)
+    await db.commit()
+    logger.debug(f"License cache for tenant {tenant_id}: {counts}")
+    return licenses
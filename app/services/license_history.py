@@ -0,0 +1,248 @@
+"""
+License usage history
+
+Every license cache refresh records one sample per tenant and SKU in
+LicenseUsageSample; trend and burn-rate queries are answered from it.
+
+Storage stays compact:
+- a refresh that sees the same consumed/enabled value as the latest sample
+  only moves that sample's last_seen_at;
+- samples start in hourly buckets and are compacted to daily buckets after
+  LICENSE_HISTORY_HOURLY_DAYS and to weekly buckets after
+  LICENSE_HISTORY_DAILY_DAYS, keeping the last value of each bucket;
+- weekly samples not seen for LICENSE_HISTORY_RETENTION_DAYS are dropped.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional, Any
+from sqlalchemy import select, insert, update, delete, func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_settings
+from app.database import AsyncSessionLocal
+from app.models import LicenseUsageSample, Tenant
+from app.schemas import O365LicenseResponse, LicenseUsagePoint, LicenseUsageTrend
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+HOUR = "hour"
+DAY = "day"
+WEEK = "week"
+
+
+def bucket_floor(moment: datetime, resolution: str) -> datetime:
+    if resolution == HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if resolution == DAY:
+        return day
+    return day - timedelta(days=day.weekday())
+
+
+async def record_license_usage(
+    db: AsyncSession,
+    tenant_id: int,
+    licenses: List[O365LicenseResponse],
+    now: Optional[datetime] = None
+) -> int:
+    """Add this refresh's sample for each SKU (does not commit); returns rows written"""
+    now = now or datetime.utcnow()
+    latest_bucket = (
+        select(LicenseUsageSample.sku_id, func.max(LicenseUsageSample.bucket_start).label("bucket_start"))
+        .where(LicenseUsageSample.tenant_id == tenant_id)
+        .group_by(LicenseUsageSample.sku_id)
+        .subquery()
+    )
+    result = await db.execute(
+        select(LicenseUsageSample)
+        .join(latest_bucket, and_(
+            LicenseUsageSample.sku_id == latest_bucket.c.sku_id,
+            LicenseUsageSample.bucket_start == latest_bucket.c.bucket_start,
+        ))
+        .where(LicenseUsageSample.tenant_id == tenant_id)
+    )
+    latest = {sample.sku_id: sample for sample in result.scalars().all()}
+
+    bucket = bucket_floor(now, HOUR)
+    unchanged: List[int] = []
+    updates: List[Dict[str, Any]] = []
+    inserts: List[Dict[str, Any]] = []
+    for license in licenses:
+        values = {"consumed_units": license.consumed_units, "enabled_units": license.enabled_units}
+        previous = latest.get(license.sku_id)
+        if previous is not None and (previous.consumed_units, previous.enabled_units) == tuple(values.values()):
+            unchanged.append(previous.id)
+        elif previous is not None and previous.bucket_start == bucket:
+            # Changed again within the hour: the bucket keeps the last value
+            updates.append({"id": previous.id, "last_seen_at": now, **values})
+        else:
+            inserts.append({
+                "tenant_id": tenant_id,
+                "sku_id": license.sku_id,
+                "sku_part_number": license.sku_part_number,
+                "resolution": HOUR,
+                "bucket_start": bucket,
+                "last_seen_at": now,
+                **values,
+            })
+
+    if unchanged:
+        await db.execute(
+            update(LicenseUsageSample).where(LicenseUsageSample.id.in_(unchanged)).values(last_seen_at=now)
+        )
+    if updates:
+        await db.execute(update(LicenseUsageSample), updates)
+    if inserts:
+        await db.execute(insert(LicenseUsageSample), inserts)
+    return len(updates) + len(inserts)
+
+
+async def _compact(db: AsyncSession, source: str, target: str, cutoff: datetime) -> int:
+    """Merge `source` samples older than cutoff into `target` buckets; returns rows removed"""
+    limit = bucket_floor(cutoff, target)
+    result = await db.execute(
+        select(LicenseUsageSample)
+        .where(LicenseUsageSample.resolution.in_([source, target]))
+        .where(LicenseUsageSample.bucket_start < limit)
+        .order_by(LicenseUsageSample.tenant_id, LicenseUsageSample.sku_id, LicenseUsageSample.bucket_start)
+    )
+    removed = 0
+    for _, series in groupby(result.scalars().all(), key=lambda sample: (sample.tenant_id, sample.sku_id)):
+        kept: Optional[LicenseUsageSample] = None
+        for bucket, group in groupby(series, key=lambda sample: bucket_floor(sample.bucket_start, target)):
+            samples = list(group)
+            # The first row keeps its place in the unique index, the last one has the bucket's value
+            first, last = samples[0], samples[-1]
+            if first.resolution != target or len(samples) > 1:
+                first.resolution = target
+                first.bucket_start = bucket
+                first.sku_part_number = last.sku_part_number
+                first.consumed_units = last.consumed_units
+                first.enabled_units = last.enabled_units
+                first.last_seen_at = max(sample.last_seen_at for sample in samples)
+            for sample in samples[1:]:
+                await db.delete(sample)
+            removed += len(samples) - 1
+
+            if kept is not None and (kept.consumed_units, kept.enabled_units) == (first.consumed_units, first.enabled_units):
+                # Same value as the previous bucket: extend that one instead
+                kept.last_seen_at = max(kept.last_seen_at, first.last_seen_at)
+                await db.delete(first)
+                removed += 1
+            else:
+                kept = first
+    await db.flush()
+    return removed
+
+
+async def compact_license_history() -> Dict[str, int]:
+    """Downsample aged samples (hour -> day -> week) and drop expired ones"""
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        to_daily = await _compact(db, HOUR, DAY, now - timedelta(days=settings.license_history_hourly_days))
+        to_weekly = await _compact(db, DAY, WEEK, now - timedelta(days=settings.license_history_daily_days))
+        pruned = 0
+        if settings.license_history_retention_days > 0:
+            cutoff = now - timedelta(days=settings.license_history_retention_days)
+            result = await db.execute(
+                delete(LicenseUsageSample)
+                .where(LicenseUsageSample.resolution == WEEK)
+                .where(LicenseUsageSample.last_seen_at < cutoff)
+            )
+            pruned = result.rowcount or 0
+        # Samples left behind by tenants deleted before delete_tenant removed them
+        result = await db.execute(
+            delete(LicenseUsageSample).where(LicenseUsageSample.tenant_id.not_in(select(Tenant.id)))
+        )
+        pruned += result.rowcount or 0
+        await db.commit()
+
+    logger.info(f"License history compacted: {to_daily} hourly and {to_weekly} daily rows merged, {pruned} pruned")
+    return {"merged_hourly": to_daily, "merged_daily": to_weekly, "pruned": pruned}
+
+
+def _trend(samples: List[LicenseUsageSample], since: datetime, include_points: bool) -> LicenseUsageTrend:
+    """Least-squares burn rate over the window, from both ends of every run"""
+    n = sum_x = sum_y = sum_xx = sum_xy = 0.0
+    points: List[LicenseUsagePoint] = []
+    for sample in samples:
+        start = max(sample.bucket_start, since)
+        for at in (start, sample.last_seen_at):
+            x = (at - since).total_seconds() / 86400
+            y = sample.consumed_units
+            n += 1
+            sum_x += x
+            sum_y += y
+            sum_xx += x * x
+            sum_xy += x * y
+        if include_points:
+            points.append(LicenseUsagePoint(
+                at=start, consumed_units=sample.consumed_units, enabled_units=sample.enabled_units
+            ))
+
+    first, last = samples[0], samples[-1]
+    if include_points:
+        points.append(LicenseUsagePoint(
+            at=last.last_seen_at, consumed_units=last.consumed_units, enabled_units=last.enabled_units
+        ))
+
+    denominator = n * sum_xx - sum_x * sum_x
+    burn_rate = (n * sum_xy - sum_x * sum_y) / denominator if denominator > 1e-9 else None
+    available = last.enabled_units - last.consumed_units
+    days_until_exhausted = None
+    if available <= 0:
+        days_until_exhausted = 0.0
+    elif burn_rate is not None and burn_rate > 0:
+        days_until_exhausted = available / burn_rate
+
+    return LicenseUsageTrend(
+        tenant_id=last.tenant_id,
+        sku_id=last.sku_id,
+        sku_part_number=last.sku_part_number,
+        consumed_units=last.consumed_units,
+        enabled_units=last.enabled_units,
+        available_units=available,
+        first_seen_at=max(first.bucket_start, since),
+        last_seen_at=last.last_seen_at,
+        consumed_change=last.consumed_units - first.consumed_units,
+        burn_rate_per_day=(round(burn_rate, 4) or 0.0) if burn_rate is not None else None,
+        days_until_exhausted=round(days_until_exhausted, 1) if days_until_exhausted is not None else None,
+        projected_exhausted_at=(
+            last.last_seen_at + timedelta(days=days_until_exhausted)
+            if days_until_exhausted is not None else None
+        ),
+        points=points,
+    )
+
+
+async def usage_trends(
+    db: AsyncSession,
+    days: int,
+    tenant_ids: Optional[Iterable[int]] = None,
+    sku_id: Optional[str] = None,
+    include_points: bool = True
+) -> List[LicenseUsageTrend]:
+    """Trend and burn-rate projection per tenant and SKU over the last `days`, in a single query"""
+    since = datetime.utcnow() - timedelta(days=days)
+    query = (
+        select(LicenseUsageSample, Tenant.tenant_name)
+        # Inner join: samples of a tenant deleted meanwhile are not reported
+        .join(Tenant, Tenant.id == LicenseUsageSample.tenant_id)
+        .where(LicenseUsageSample.last_seen_at >= since)
+        .order_by(LicenseUsageSample.tenant_id, LicenseUsageSample.sku_id, LicenseUsageSample.bucket_start)
+    )
+    if tenant_ids:
+        query = query.where(LicenseUsageSample.tenant_id.in_(list(tenant_ids)))
+    if sku_id:
+        query = query.where(LicenseUsageSample.sku_id == sku_id)
+    result = await db.execute(query)
+
+    trends = []
+    for _, series in groupby(result.all(), key=lambda row: (row[0].tenant_id, row[0].sku_id)):
+        rows = list(series)
+        trend = _trend([sample for sample, _ in rows], since, include_points)
+        trend.tenant_name = rows[0][1]
+        trends.append(trend)
+    return trends
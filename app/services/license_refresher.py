@@ -0,0 +1,158 @@
+"""
+License cache refresher
+
+Stale-while-revalidate for LicenseCache: routes always answer from the cache
+(flagging it stale when needed) while this refresher renews each tenant's
+cache in the background before it expires. Due times are derived from the
+cache age and the tenant's refresh interval, with a per-tenant offset so
+refreshes are spread out instead of all firing at once.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_settings
+from app.database import AsyncSessionLocal
+from app.models import Tenant, LicenseCache
+from app.services.license_cache import refresh_tenant_licenses, tenant_cache_ttl, is_cache_stale
+from app.services.tenant_registry import tenant_registry
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Failed refreshes back off from this delay, doubling up to the tenant's interval
+FAILURE_BACKOFF = timedelta(minutes=5)
+
+
+@dataclass
+class QueueEntry:
+    tenant: Tenant
+    cached_at: Optional[datetime]
+    due_at: datetime
+
+
+class LicenseRefresher:
+    def __init__(self):
+        self._in_progress: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._failures: Dict[int, Tuple[int, datetime, str]] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, settings.license_refresh_concurrency))
+        return self._semaphore
+
+    @staticmethod
+    def _spread_offset(tenant: Tenant) -> timedelta:
+        # Golden-ratio sequence: deterministic, evenly spread fraction per tenant
+        fraction = (tenant.id * 0.6180339887) % 1
+        window = tenant_cache_ttl(tenant) * (1 - settings.license_refresh_ahead_ratio)
+        return window * fraction
+
+    def due_at(self, tenant: Tenant, cached_at: Optional[datetime]) -> datetime:
+        if cached_at is None:
+            return datetime.utcnow()
+        ahead = tenant_cache_ttl(tenant) * settings.license_refresh_ahead_ratio
+        return cached_at + ahead + self._spread_offset(tenant)
+
+    async def load_queue(self, db: AsyncSession) -> List[QueueEntry]:
+        """Active tenants with their oldest cache row, ordered by when they are due"""
+        oldest = (
+            select(LicenseCache.tenant_id, func.min(LicenseCache.cached_at).label("cached_at"))
+            .group_by(LicenseCache.tenant_id)
+            .subquery()
+        )
+        result = await db.execute(
+            select(Tenant, oldest.c.cached_at)
+            .outerjoin(oldest, oldest.c.tenant_id == Tenant.id)
+            .where(Tenant.is_active == True)
+        )
+        entries = [
+            QueueEntry(tenant=tenant, cached_at=cached_at, due_at=self.due_at(tenant, cached_at))
+            for tenant, cached_at in result.all()
+        ]
+        entries.sort(key=lambda entry: entry.due_at)
+        return entries
+
+    def _backing_off(self, tenant_id: int, now: datetime) -> bool:
+        failure = self._failures.get(tenant_id)
+        return failure is not None and failure[1] > now
+
+    async def refresh(self, tenant: Tenant) -> bool:
+        """Refresh one tenant's cache now; returns False if it failed or was already running"""
+        if tenant.id in self._in_progress:
+            return False
+        self._in_progress.add(tenant.id)
+        try:
+            async with self.semaphore:
+                async with AsyncSessionLocal() as db:
+                    graph_service = tenant_registry.get_graph_service(tenant)
+                    await refresh_tenant_licenses(db, tenant.id, graph_service)
+            self._failures.pop(tenant.id, None)
+            logger.info(f"Background license refresh completed for tenant {tenant.id}")
+            return True
+        except Exception as e:
+            count = self._failures.get(tenant.id, (0, None, None))[0] + 1
+            backoff = min(FAILURE_BACKOFF * (2 ** (count - 1)), tenant_cache_ttl(tenant))
+            self._failures[tenant.id] = (count, datetime.utcnow() + backoff, str(e)[:500])
+            logger.warning(f"Background license refresh failed for tenant {tenant.id} ({count}x): {e}")
+            return False
+        finally:
+            self._in_progress.discard(tenant.id)
+
+    def request(self, tenant: Tenant) -> None:
+        """Revalidate a stale tenant in the background (no-op if already running or backing off)"""
+        if tenant.id in self._in_progress or self._backing_off(tenant.id, datetime.utcnow()):
+            return
+        task = asyncio.create_task(self.refresh(tenant))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def tick(self) -> Dict[str, int]:
+        """Refresh tenants that are due, at most LICENSE_REFRESH_MAX_PER_TICK per run"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            queue = await self.load_queue(db)
+
+        due = [
+            entry for entry in queue
+            if entry.due_at <= now
+            and entry.tenant.id not in self._in_progress
+            and not self._backing_off(entry.tenant.id, now)
+        ][:settings.license_refresh_max_per_tick]
+
+        outcomes = await asyncio.gather(*(self.refresh(entry.tenant) for entry in due))
+        return {"due": len(due), "refreshed": sum(outcomes), "queued": len(queue)}
+
+    def describe(self, entries: List[QueueEntry]) -> List[dict]:
+        items = []
+        for entry in entries:
+            failure = self._failures.get(entry.tenant.id)
+            items.append({
+                "tenant_id": entry.tenant.id,
+                "tenant_name": entry.tenant.tenant_name,
+                "interval_minutes": int(tenant_cache_ttl(entry.tenant).total_seconds() // 60),
+                "cached_at": entry.cached_at,
+                "due_at": entry.due_at,
+                "stale": is_cache_stale(entry.tenant, entry.cached_at),
+                "in_progress": entry.tenant.id in self._in_progress,
+                "failures": failure[0] if failure else 0,
+                "retry_at": failure[1] if failure else None,
+                "last_error": failure[2] if failure else None,
+            })
+        return items
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+license_refresher = LicenseRefresher()
@@ -1,6 +1,7 @@
 import msal
 from typing import Optional, Dict, Any
 from app.config import get_settings
+from app.services.token_provider import token_provider
 
 settings = get_settings()
 
@@ -24,19 +25,31 @@ class MSALService:
             )
         return self._app
     
-    def get_access_token(self) -> Optional[str]:
+    def reset_app(self) -> None:
+        """Discard the MSAL application (and its in-memory token cache)"""
+        self._app = None
+    
+    def acquire_token_result(self) -> Dict[str, Any]:
+        """Blocking MSAL call; returns the raw token result or raises on failure"""
         result = self.app.acquire_token_for_client(scopes=self.scope)
         
         if "access_token" in result:
-            return result["access_token"]
+            return result
         else:
             error = result.get("error")
             error_description = result.get("error_description")
             raise Exception(f"Failed to acquire token: {error} - {error_description}")
     
-    async def validate_credentials(self) -> Dict[str, Any]:
+    def get_access_token(self) -> Optional[str]:
+        return self.acquire_token_result()["access_token"]
+    
+    async def get_access_token_async(self, force_refresh: bool = False) -> str:
+        """Non-blocking, cached token lookup shared by all services of this tenant"""
+        return await token_provider.get_token(self, force_refresh=force_refresh)
+    
+    async def validate_credentials(self, force_refresh: bool = False) -> Dict[str, Any]:
         try:
-            token = self.get_access_token()
+            token = await self.get_access_token_async(force_refresh=force_refresh)
             return {
                 "valid": True,
                 "token": token
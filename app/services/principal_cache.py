@@ -0,0 +1,137 @@
+"""
+Authenticated principal cache
+
+get_current_user runs on every authenticated request. Two bounded LRU caches
+keep it off the database:
+
+- decoded tokens, keyed by the SHA-256 digest of the raw token and kept
+  until the token's own exp;
+- active users, keyed by username and token issue time (iat) and kept for
+  AUTH_PRINCIPAL_CACHE_TTL_SECONDS.
+
+A user's entries are dropped when the row is updated (password change,
+deactivation, ...) or deleted through the ORM, both at flush and again after
+the commit. Changes made outside this
+process (another worker, raw SQL) are picked up once the TTL runs out.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from app.config import get_settings
+from app.models import User
+
+settings = get_settings()
+
+# session.info key: usernames changed in the session's current transaction
+PENDING_INVALIDATIONS = "principal_cache_invalidations"
+
+
+class _ExpiringLRU:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any, expires_at: float) -> None:
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def drop_where(self, predicate) -> None:
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class PrincipalCache:
+    def __init__(
+        self,
+        ttl: float = settings.auth_principal_cache_ttl_seconds,
+        max_principals: int = settings.auth_principal_cache_max_size,
+        max_tokens: int = settings.auth_token_cache_max_size,
+    ):
+        self.ttl = ttl
+        self._principals = _ExpiringLRU(max_principals if ttl > 0 else 0)
+        self._tokens = _ExpiringLRU(max_tokens)
+        # Bumped on every invalidation, so a lookup that raced with one is not cached
+        self._generations: Dict[str, int] = {}
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get_payload(self, token: str) -> Optional[Dict[str, Any]]:
+        return self._tokens.get(self._digest(token))
+
+    def put_payload(self, token: str, payload: Dict[str, Any]) -> None:
+        expires_at = payload.get("exp")
+        if isinstance(expires_at, (int, float)):
+            self._tokens.put(self._digest(token), payload, float(expires_at))
+
+    def generation(self, username: str) -> int:
+        return self._generations.get(username, 0)
+
+    def get_user(self, username: str, issued_at: Optional[int]) -> Optional[User]:
+        return self._principals.get((username, issued_at))
+
+    def put_user(self, username: str, issued_at: Optional[int], user: User, generation: int) -> None:
+        """Cache an active user loaded at `generation` (skipped if it was invalidated meanwhile)"""
+        if generation == self.generation(username):
+            self._principals.put((username, issued_at), user, time.time() + self.ttl)
+
+    def invalidate(self, username: str) -> None:
+        self._generations[username] = self.generation(username) + 1
+        self._principals.drop_where(lambda key: key[0] == username)
+
+    def clear(self) -> None:
+        self._principals.clear()
+        self._tokens.clear()
+        self._generations.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user(mapper, connection, target: User) -> None:
+    usernames = {target.username}
+    # A rename leaves the old username's entries behind
+    usernames.update(inspect(target).attrs.username.history.deleted or ())
+    for username in usernames:
+        principal_cache.invalidate(username)
+    # Until commit other requests still read the old row and could cache it
+    # again: invalidate a second time once the change is visible
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(PENDING_INVALIDATIONS, set()).update(usernames)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session: Session) -> None:
+    for username in session.info.pop(PENDING_INVALIDATIONS, ()):
+        principal_cache.invalidate(username)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(PENDING_INVALIDATIONS, None)
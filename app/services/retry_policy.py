@@ -0,0 +1,100 @@
+"""
+Retry policy for Graph API calls
+
+Decides whether a failed call is retried and how long to wait: Graph's
+Retry-After header wins, otherwise exponential backoff with full jitter.
+Per-tenant counters record retries and time spent sleeping so throttling
+pressure is visible.
+"""
+
+import random
+from dataclasses import dataclass, field, asdict
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Dict, Optional, Mapping, FrozenSet
+from app.config import get_settings
+
+settings = get_settings()
+
+# Graph has not processed the request for these, so they are safe to resend for any method
+ALWAYS_RETRYABLE_STATUSES = frozenset({429, 503})
+# These may have been (partially) processed, so only idempotent methods are resent
+IDEMPOTENT_RETRYABLE_STATUSES = frozenset({500, 502, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "PATCH"})
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = settings.graph_retry_max_attempts
+    base_delay: float = settings.graph_retry_base_delay
+    max_delay: float = settings.graph_retry_max_delay
+    deadline: float = settings.graph_request_deadline
+    always_retryable: FrozenSet[int] = ALWAYS_RETRYABLE_STATUSES
+    idempotent_retryable: FrozenSet[int] = IDEMPOTENT_RETRYABLE_STATUSES
+
+    def should_retry_status(self, method: str, status: int) -> bool:
+        if status in self.always_retryable:
+            return True
+        return status in self.idempotent_retryable and method.upper() in IDEMPOTENT_METHODS
+
+    def should_retry_connection_error(self, method: str) -> bool:
+        return method.upper() in IDEMPOTENT_METHODS
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given (1-based) attempt"""
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+    @staticmethod
+    def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+        """Parse Retry-After as delta-seconds or an HTTP date"""
+        value = headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+@dataclass
+class TenantRequestStats:
+    tenant_id: str
+    requests: int = 0
+    retries: int = 0
+    throttled: int = 0
+    token_refreshes: int = 0
+    deadline_exceeded: int = 0
+    sleep_seconds: float = 0.0
+
+    def record_retry(self, delay: float, throttled: bool = False) -> None:
+        self.retries += 1
+        self.sleep_seconds += delay
+        if throttled:
+            self.throttled += 1
+
+
+@dataclass
+class RequestStatsRegistry:
+    _stats: Dict[str, TenantRequestStats] = field(default_factory=dict)
+
+    def for_tenant(self, tenant_id: str) -> TenantRequestStats:
+        stats = self._stats.get(tenant_id)
+        if stats is None:
+            stats = self._stats[tenant_id] = TenantRequestStats(tenant_id=tenant_id)
+        return stats
+
+    def snapshot(self) -> list:
+        return [asdict(stats) for stats in self._stats.values()]
+
+    def reset(self) -> None:
+        self._stats.clear()
+
+
+default_retry_policy = RetryPolicy()
+request_stats = RequestStatsRegistry()
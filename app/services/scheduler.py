@@ -0,0 +1,124 @@
+"""
+Background job scheduler
+
+Minimal periodic job runner driven by the app lifespan. Each job runs in its
+own asyncio task, never overlaps with itself and can also be triggered on
+demand.
+"""
+
+import asyncio
+import logging
+import random
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob:
+    def __init__(
+        self,
+        name: str,
+        interval_seconds: float,
+        func: Callable[[], Awaitable[Any]],
+        initial_delay: float = 0.0,
+        jitter: float = 0.1,
+    ):
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.func = func
+        self.initial_delay = initial_delay
+        self.jitter = jitter
+        self.runs = 0
+        self.last_started_at: Optional[datetime] = None
+        self.last_finished_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.last_result: Any = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def run_now(self) -> Any:
+        """Run the job immediately; waits if a run is already in progress"""
+        async with self._lock:
+            self.last_started_at = datetime.utcnow()
+            try:
+                self.last_result = await self.func()
+                self.last_error = None
+                return self.last_result
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            finally:
+                self.runs += 1
+                self.last_finished_at = datetime.utcnow()
+
+    async def _loop(self) -> None:
+        await asyncio.sleep(self.initial_delay)
+        while True:
+            try:
+                await self.run_now()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scheduled job {self.name} failed: {e}", exc_info=True)
+            # Jitter keeps jobs started together from firing in lockstep
+            spread = self.interval_seconds * self.jitter
+            await asyncio.sleep(self.interval_seconds + random.uniform(-spread, spread))
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(), name=f"job:{self.name}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "interval_seconds": self.interval_seconds,
+            "running": self.running,
+            "runs": self.runs,
+            "last_started_at": self.last_started_at,
+            "last_finished_at": self.last_finished_at,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    def __init__(self):
+        self._jobs: Dict[str, PeriodicJob] = {}
+        self._started = False
+
+    def add(self, job: PeriodicJob) -> PeriodicJob:
+        self._jobs[job.name] = job
+        if self._started:
+            job.start()
+        return job
+
+    def get(self, name: str) -> Optional[PeriodicJob]:
+        return self._jobs.get(name)
+
+    def jobs(self) -> List[PeriodicJob]:
+        return list(self._jobs.values())
+
+    def start(self) -> None:
+        self._started = True
+        for job in self._jobs.values():
+            job.start()
+
+    async def stop(self) -> None:
+        self._started = False
+        await asyncio.gather(*(job.stop() for job in self._jobs.values()))
+
+
+scheduler = Scheduler()
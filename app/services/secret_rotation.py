@@ -0,0 +1,238 @@
+"""
+Bulk client secret rotation
+
+Rotates the client secret of many tenants in one background job. The job
+runs in phases so that a tenant is never left without a working secret:
+
+1. add a new password credential for every selected tenant (concurrently);
+2. save all new secrets in a single database transaction;
+3. optionally remove each tenant's previous credential, still using the
+   token issued for the old secret;
+4. invalidate cached MSAL apps, tokens and circuit state.
+
+A crash before step 2 only leaves unused extra credentials behind; the old
+secrets keep working.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+from sqlalchemy import select, update, or_
+from app.config import get_settings
+from app.database import AsyncSessionLocal
+from app.models import Tenant
+from app.services.graph_service import GraphAPIError
+from app.services.tenant_registry import tenant_registry
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Graph only reveals the first characters of a secret ("hint")
+SECRET_HINT_LENGTH = 3
+
+
+def parse_graph_datetime(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def find_current_key_id(credentials: List[Dict[str, Any]], client_secret: str) -> Optional[str]:
+    """keyId of the credential the stored secret belongs to (None unless exactly one matches)"""
+    hint = (client_secret or "")[:SECRET_HINT_LENGTH]
+    matches = [credential["keyId"] for credential in credentials if credential.get("hint") == hint]
+    return matches[0] if len(matches) == 1 else None
+
+
+class SecretRotationJob:
+    def __init__(self):
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.phase: Optional[str] = None
+        self.error: Optional[str] = None
+        self.delete_old_secret = False
+        self.results: Dict[int, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def select_tenants(
+        self,
+        expires_within_days: int,
+        tenant_ids: Optional[Iterable[int]] = None,
+        include_unknown_expiry: bool = False
+    ) -> List[Tenant]:
+        """Active tenants whose secret expires within the window (optionally also unknown expiry)"""
+        cutoff = datetime.utcnow() + timedelta(days=expires_within_days)
+        expiring = Tenant.client_secret_expires_at <= cutoff
+        if include_unknown_expiry:
+            expiring = or_(expiring, Tenant.client_secret_expires_at.is_(None))
+
+        query = select(Tenant).where(Tenant.is_active == True).where(expiring).order_by(Tenant.id)
+        if tenant_ids:
+            query = query.where(Tenant.id.in_(list(tenant_ids)))
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(query)
+            return list(result.scalars().all())
+
+    def start(self, tenants: List[Tenant], delete_old_secret: bool = False) -> None:
+        if self.running:
+            raise RuntimeError("Secret rotation already running")
+        self.started_at = datetime.utcnow()
+        self.finished_at = None
+        self.error = None
+        self.phase = "pending"
+        self.delete_old_secret = delete_old_secret
+        self.results = {
+            tenant.id: {
+                "tenant_id": tenant.id,
+                "tenant_name": tenant.tenant_name,
+                "status": "pending",
+                "previous_expires_at": tenant.client_secret_expires_at,
+                "expires_at": None,
+                "old_secret_removed": None,
+                "error": None,
+            }
+            for tenant in tenants
+        }
+        self._task = asyncio.create_task(self._run(tenants), name="secret-rotation")
+
+    async def _add_secret(self, tenant: Tenant, semaphore: asyncio.Semaphore) -> Optional[Dict[str, Any]]:
+        report = self.results[tenant.id]
+        async with semaphore:
+            try:
+                graph_service = tenant_registry.get_graph_service(tenant)
+                application = await graph_service.get_application(tenant.client_id)
+                created = await graph_service.add_client_secret(application["id"])
+            except Exception as e:
+                report["status"] = "failed"
+                report["error"] = str(e)[:500]
+                logger.warning(f"Secret rotation failed for tenant {tenant.id}: {e}")
+                return None
+        if not created.get("secretText"):
+            # The credential exists on the app but its secret is unknown: it can never be used
+            report["status"] = "failed"
+            report["error"] = f"新密钥未返回 secretText，应用上遗留了无用凭据 keyId={created.get('keyId')}，请手动删除"
+            logger.warning(
+                f"Secret rotation for tenant {tenant.id}: addPassword returned no secretText, "
+                f"orphaned credential {created.get('keyId')}"
+            )
+            return None
+        report["status"] = "created"
+        return {
+            "tenant": tenant,
+            "app_object_id": application["id"],
+            "old_key_id": find_current_key_id(application.get("passwordCredentials", []), tenant.client_secret),
+            "new_key_id": created.get("keyId"),
+            "secret": created.get("secretText"),
+            "expires_at": parse_graph_datetime(created.get("endDateTime")),
+        }
+
+    async def _remove_old_secret(self, rotation: Dict[str, Any], semaphore: asyncio.Semaphore) -> None:
+        tenant = rotation["tenant"]
+        report = self.results[tenant.id]
+        old_key_id = rotation["old_key_id"]
+        if not old_key_id or old_key_id == rotation["new_key_id"]:
+            # Can't tell which credential is in use: keep it rather than guess
+            report["old_secret_removed"] = False
+            return
+        async with semaphore:
+            graph_service = tenant_registry.get_graph_service(tenant)
+            for attempt in range(1, 4):
+                try:
+                    await graph_service.remove_client_secret(rotation["app_object_id"], old_key_id)
+                    report["old_secret_removed"] = True
+                    return
+                except GraphAPIError as e:
+                    # The application object may still be settling after addPassword
+                    if e.status == 409 and attempt < 3:
+                        await asyncio.sleep(graph_service.retry_policy.backoff(attempt))
+                        continue
+                    report["old_secret_removed"] = False
+                    report["error"] = f"旧密钥删除失败: {e}"[:500]
+                    return
+                except Exception as e:
+                    report["old_secret_removed"] = False
+                    report["error"] = f"旧密钥删除失败: {e}"[:500]
+                    return
+
+    async def _run(self, tenants: List[Tenant]) -> None:
+        semaphore = asyncio.Semaphore(max(1, settings.secret_rotation_concurrency))
+        try:
+            self.phase = "adding"
+            created = await asyncio.gather(*(self._add_secret(tenant, semaphore) for tenant in tenants))
+            rotations = [rotation for rotation in created if rotation]
+
+            self.phase = "saving"
+            if rotations:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(update(Tenant), [
+                        {
+                            "id": rotation["tenant"].id,
+                            "client_secret": rotation["secret"],
+                            "client_secret_expires_at": rotation["expires_at"],
+                        }
+                        for rotation in rotations
+                    ])
+                    await db.commit()
+            for rotation in rotations:
+                report = self.results[rotation["tenant"].id]
+                report["status"] = "rotated"
+                report["expires_at"] = rotation["expires_at"]
+
+            if self.delete_old_secret:
+                self.phase = "removing"
+                await asyncio.gather(*(self._remove_old_secret(rotation, semaphore) for rotation in rotations))
+
+            self.phase = "invalidating"
+            for rotation in rotations:
+                tenant = rotation["tenant"]
+                tenant_registry.invalidate(tenant.id, tenant.tenant_id)
+
+            self.phase = "completed"
+            logger.info(f"Secret rotation: {len(rotations)}/{len(tenants)} tenants rotated")
+        except asyncio.CancelledError:
+            self.phase = "cancelled"
+            raise
+        except Exception as e:
+            # Nothing was saved: the added credentials are unused and the old secrets still work
+            self.phase = "failed"
+            self.error = str(e)
+            for report in self.results.values():
+                if report["status"] == "created":
+                    report["status"] = "failed"
+                    report["error"] = f"保存新密钥失败: {e}"[:500]
+            logger.error(f"Secret rotation failed: {e}", exc_info=True)
+        finally:
+            self.finished_at = datetime.utcnow()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def status(self) -> Dict[str, Any]:
+        results = list(self.results.values())
+        counts = {"pending": 0, "created": 0, "rotated": 0, "failed": 0}
+        for report in results:
+            counts[report["status"]] += 1
+        return {
+            "running": self.running,
+            "phase": self.phase,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "delete_old_secret": self.delete_old_secret,
+            "total": len(results),
+            **counts,
+            "error": self.error,
+            "results": results,
+        }
+
+
+secret_rotation = SecretRotationJob()
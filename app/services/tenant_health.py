@@ -0,0 +1,147 @@
+"""
+Fleet-wide tenant checks
+
+Runs per-tenant health checks (credential validation, SharePoint Online
+availability) across many tenants concurrently within a configured bound.
+Results are written back to the tenants table in batches rather than one
+commit per tenant.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+from sqlalchemy import select, update
+from app.config import get_settings
+from app.database import AsyncSessionLocal
+from app.models import Tenant
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.tenant_registry import tenant_registry
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Flush credential results to the database every N tenants
+CREDENTIAL_WRITE_BATCH = 50
+
+
+async def check_tenant_credentials(tenant: Tenant) -> Dict[str, Any]:
+    """Acquire a fresh token for one tenant; never raises"""
+    msal_service = tenant_registry.get_msal_service(tenant)
+    validation_result = await msal_service.validate_credentials(force_refresh=True)
+    valid = validation_result["valid"]
+    return {
+        "tenant_id": tenant.id,
+        "tenant_name": tenant.tenant_name,
+        "valid": valid,
+        "message": "凭据有效" if valid else "凭据无效",
+        "error": validation_result.get("error"),
+        "checked_at": datetime.now(),
+    }
+
+
+async def save_credential_results(results: List[Dict[str, Any]]) -> None:
+    """Write credential_status / credential_checked_at for many tenants in one statement"""
+    if not results:
+        return
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Tenant), [
+            {
+                "id": result["tenant_id"],
+                "credential_status": "valid" if result["valid"] else "invalid",
+                "credential_message": result["message"],
+                "credential_checked_at": result["checked_at"],
+            }
+            for result in results
+        ])
+        await db.commit()
+
+
+async def iter_credential_checks(tenants: Iterable[Tenant]) -> AsyncIterator[Dict[str, Any]]:
+    """Validate tenants concurrently, yielding each result as soon as it is ready
+
+    Results are persisted in batches of CREDENTIAL_WRITE_BATCH; whatever has
+    completed is still saved if the consumer stops early.
+    """
+    semaphore = asyncio.Semaphore(max(1, settings.credential_check_concurrency))
+
+    async def run(tenant: Tenant) -> Dict[str, Any]:
+        async with semaphore:
+            return await check_tenant_credentials(tenant)
+
+    tasks = [asyncio.create_task(run(tenant)) for tenant in tenants]
+    pending: List[Dict[str, Any]] = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            pending.append(result)
+            if len(pending) >= CREDENTIAL_WRITE_BATCH:
+                await save_credential_results(pending)
+                pending = []
+            yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Shielded so results gathered so far survive a client disconnect
+        await asyncio.shield(save_credential_results(pending))
+        logger.info(f"Credential check finished for {len(tasks)} tenants")
+
+
+async def check_tenant_spo(tenant: Tenant) -> Optional[Dict[str, Any]]:
+    """Probe SharePoint Online for one tenant; reuses the tenant's cached token
+
+    Returns None while the tenant's circuit is open, so the last real status is kept.
+    """
+    graph_service = tenant_registry.get_graph_service(tenant)
+    try:
+        spo_result = await graph_service.check_spo_status()
+    except CircuitOpenError as e:
+        logger.debug(f"SPO check skipped for tenant {tenant.id}: {e}")
+        return None
+    return {
+        "id": tenant.id,
+        "spo_status": spo_result["status"],
+        "spo_message": spo_result["message"][:200],
+        "spo_checked_at": datetime.now(),
+    }
+
+
+async def sweep_spo_status(tenant_ids: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+    """Refresh spo_status for every active tenant and save all results in one transaction
+
+    Tenants whose credentials are known to be invalid, or whose circuit is
+    open, are skipped instead of failing one token request each.
+    """
+    async with AsyncSessionLocal() as db:
+        query = select(Tenant).where(Tenant.is_active == True)
+        if tenant_ids is not None:
+            query = query.where(Tenant.id.in_(list(tenant_ids)))
+        result = await db.execute(query)
+        tenants = result.scalars().all()
+
+    eligible = [tenant for tenant in tenants if tenant.credential_status != "invalid"]
+    semaphore = asyncio.Semaphore(max(1, settings.spo_sweep_concurrency))
+
+    async def run(tenant: Tenant) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            return await check_tenant_spo(tenant)
+
+    checked = await asyncio.gather(*(run(tenant) for tenant in eligible))
+    results = [result for result in checked if result is not None]
+
+    if results:
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Tenant), list(results))
+            await db.commit()
+
+    statuses = Counter(result["spo_status"] for result in results)
+    logger.info(
+        f"SPO sweep: {len(results)} tenants checked, {len(tenants) - len(results)} skipped, {dict(statuses)}"
+    )
+    return {
+        "total": len(tenants),
+        "checked": len(results),
+        "skipped": len(tenants) - len(results),
+        "statuses": dict(statuses),
+    }
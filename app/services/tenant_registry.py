@@ -0,0 +1,102 @@
+"""
+Tenant service registry
+
+Keeps long-lived MSALService/GraphAPIService instances per tenant so MSAL's
+in-memory token cache and authority discovery survive across HTTP requests.
+Entries are keyed by the tenant row id plus a hash of its credentials and
+bounded by an LRU.
+"""
+
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from app.config import get_settings
+from app.models import Tenant
+from app.services.msal_service import MSALService
+from app.services.graph_service import GraphAPIService
+from app.services.token_provider import token_provider
+from app.services.circuit_breaker import circuit_breakers
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+@dataclass
+class _RegistryEntry:
+    fingerprint: str
+    msal_service: MSALService
+    graph_service: GraphAPIService
+
+
+class TenantServiceRegistry:
+    def __init__(self, max_size: int = settings.tenant_registry_max_size):
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, _RegistryEntry]" = OrderedDict()
+
+    @staticmethod
+    def fingerprint(tenant: Tenant) -> str:
+        raw = f"{tenant.tenant_id}\0{tenant.client_id}\0{tenant.client_secret}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _get_entry(self, tenant: Tenant) -> _RegistryEntry:
+        fingerprint = self.fingerprint(tenant)
+        entry = self._entries.get(tenant.id)
+
+        if entry is not None and entry.fingerprint == fingerprint:
+            self._entries.move_to_end(tenant.id)
+            return entry
+
+        if entry is not None:
+            # Credentials changed underneath us
+            self._drop(tenant.id)
+
+        msal_service = MSALService(
+            tenant_id=tenant.tenant_id,
+            client_id=tenant.client_id,
+            client_secret=tenant.client_secret
+        )
+        entry = _RegistryEntry(
+            fingerprint=fingerprint,
+            msal_service=msal_service,
+            graph_service=GraphAPIService(msal_service),
+        )
+        self._entries[tenant.id] = entry
+
+        while len(self._entries) > self.max_size:
+            oldest_id = next(iter(self._entries))
+            logger.debug(f"Evicting tenant {oldest_id} from service registry")
+            self._drop(oldest_id)
+
+        return entry
+
+    def get_msal_service(self, tenant: Tenant) -> MSALService:
+        return self._get_entry(tenant).msal_service
+
+    def get_graph_service(self, tenant: Tenant) -> GraphAPIService:
+        return self._get_entry(tenant).graph_service
+
+    def _drop(self, tenant_row_id: int) -> Optional[_RegistryEntry]:
+        entry = self._entries.pop(tenant_row_id, None)
+        if entry is not None:
+            token_provider.invalidate(entry.msal_service.tenant_id, entry.msal_service.client_id)
+        return entry
+
+    def invalidate(self, tenant_row_id: int, directory_tenant_id: Optional[str] = None) -> None:
+        """Forget cached services, tokens and circuit state for a tenant (after update/delete/secret rotation)"""
+        entry = self._drop(tenant_row_id)
+        if entry is not None:
+            circuit_breakers.reset(entry.msal_service.tenant_id)
+        if directory_tenant_id:
+            circuit_breakers.reset(directory_tenant_id)
+
+    def clear(self) -> None:
+        for tenant_row_id in list(self._entries):
+            self._drop(tenant_row_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+tenant_registry = TenantServiceRegistry()
@@ -0,0 +1,138 @@
+"""
+Tenant snapshots
+
+Periodically records per-tenant aggregates in TenantReport so the fleet
+dashboard can be served from the database alone. Snapshots are built from
+cheap queries only: `/users/$count` breakdowns, one $batch of role-member
+counts and data already stored locally (license cache, SPO status).
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import get_settings
+from app.database import AsyncSessionLocal
+from app.models import Tenant, TenantReport
+from app.services.license_cache import read_cached_licenses
+from app.services.tenant_registry import tenant_registry
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+SNAPSHOT_REPORT_TYPE = "snapshot"
+
+# roleTemplateId of "Global Administrator" (identical in every tenant)
+GLOBAL_ADMIN_ROLE_TEMPLATE_ID = "62e90394-69f5-4237-9190-012177145e10"
+
+
+async def snapshot_tenant(tenant: Tenant) -> Dict[str, Any]:
+    """Collect aggregates for one tenant from Graph"""
+    graph_service = tenant_registry.get_graph_service(tenant)
+    user_counts, roles = await asyncio.gather(
+        graph_service.get_user_counts(),
+        graph_service.get_directory_roles(),
+    )
+    member_counts = await graph_service.count_role_members([role["id"] for role in roles])
+
+    role_members = {}
+    total_admins = 0
+    for role in roles:
+        count = member_counts.get(role["id"])
+        role_members[role.get("displayName") or role["id"]] = count
+        if role.get("roleTemplateId") == GLOBAL_ADMIN_ROLE_TEMPLATE_ID:
+            total_admins = count or 0
+
+    return {
+        "total_users": user_counts["total"],
+        "total_admins": total_admins,
+        "user_counts": user_counts,
+        "role_members": role_members,
+    }
+
+
+def build_report(tenant: Tenant, counts: Dict[str, Any], license_rows: List[Any]) -> TenantReport:
+    report_data = {
+        "users": counts["user_counts"],
+        "role_members": counts["role_members"],
+        "license_enabled": sum(row.enabled_units or 0 for row in license_rows),
+        "license_consumed": sum(row.consumed_units or 0 for row in license_rows),
+        "spo_status": tenant.spo_status,
+        "credential_status": tenant.credential_status,
+    }
+    return TenantReport(
+        tenant_id=tenant.tenant_id,
+        report_type=SNAPSHOT_REPORT_TYPE,
+        total_users=counts["total_users"],
+        total_admins=counts["total_admins"],
+        spo_available=tenant.spo_status == "available",
+        report_data=json.dumps(report_data, ensure_ascii=False),
+    )
+
+
+async def snapshot_all_tenants() -> Dict[str, Any]:
+    """Append one TenantReport snapshot per active tenant and prune old snapshots"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Tenant).where(Tenant.is_active == True))
+        tenants = result.scalars().all()
+        license_rows = await read_cached_licenses(db, [tenant.id for tenant in tenants])
+
+    # Tenants with known-bad credentials would only burn a token request each
+    eligible = [tenant for tenant in tenants if tenant.credential_status != "invalid"]
+    semaphore = asyncio.Semaphore(max(1, settings.tenant_snapshot_concurrency))
+
+    async def run(tenant: Tenant) -> Tuple[Tenant, Optional[Dict[str, Any]]]:
+        async with semaphore:
+            try:
+                return tenant, await snapshot_tenant(tenant)
+            except Exception as e:
+                logger.warning(f"Snapshot failed for tenant {tenant.id}: {e}")
+                return tenant, None
+
+    outcomes = await asyncio.gather(*(run(tenant) for tenant in eligible))
+    reports = [
+        build_report(tenant, counts, license_rows.get(tenant.id, []))
+        for tenant, counts in outcomes
+        if counts is not None
+    ]
+
+    async with AsyncSessionLocal() as db:
+        db.add_all(reports)
+        pruned = 0
+        if settings.tenant_snapshot_retention_days > 0:
+            cutoff = datetime.utcnow() - timedelta(days=settings.tenant_snapshot_retention_days)
+            result = await db.execute(
+                delete(TenantReport)
+                .where(TenantReport.report_type == SNAPSHOT_REPORT_TYPE)
+                .where(TenantReport.created_at < cutoff)
+            )
+            pruned = result.rowcount or 0
+        await db.commit()
+
+    logger.info(f"Tenant snapshots: {len(reports)} written, {len(eligible) - len(reports)} failed, {pruned} pruned")
+    return {
+        "total": len(tenants),
+        "written": len(reports),
+        "failed": len(eligible) - len(reports),
+        "skipped": len(tenants) - len(eligible),
+    }
+
+
+async def latest_snapshots(db: AsyncSession) -> List[Tuple[Tenant, Optional[TenantReport]]]:
+    """Every tenant paired with its most recent snapshot (None if it has none yet)"""
+    latest = (
+        select(func.max(TenantReport.id).label("id"))
+        .where(TenantReport.report_type == SNAPSHOT_REPORT_TYPE)
+        .group_by(TenantReport.tenant_id)
+        .subquery()
+    )
+    reports = await db.execute(
+        select(TenantReport).where(TenantReport.id.in_(select(latest.c.id)))
+    )
+    by_tenant = {report.tenant_id: report for report in reports.scalars().all()}
+
+    tenants = await db.execute(select(Tenant).order_by(Tenant.id))
+    return [(tenant, by_tenant.get(tenant.tenant_id)) for tenant in tenants.scalars().all()]
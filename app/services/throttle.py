@@ -0,0 +1,138 @@
+"""
+Per-tenant adaptive concurrency limiter
+
+Each tenant gets its own concurrency window and token bucket, so one
+heavily throttled tenant cannot starve the others. The window adapts with
+AIMD: it grows additively while calls succeed within the latency target and
+shrinks multiplicatively on 429/503 or slow responses.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, AsyncIterator
+from app.config import get_settings
+
+settings = get_settings()
+
+# Statuses that mean "back off now"
+OVERLOAD_STATUSES = frozenset({429, 503})
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        # Waiters queue on the lock, so tokens are handed out in FIFO order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _Slot:
+    status: Optional[int] = None
+
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(
+        self,
+        initial_limit: int = settings.graph_tenant_initial_concurrency,
+        min_limit: int = settings.graph_tenant_min_concurrency,
+        max_limit: int = settings.graph_tenant_max_concurrency,
+        rate_per_second: float = settings.graph_tenant_rate_per_second,
+        burst: int = settings.graph_tenant_burst,
+        latency_target: float = settings.graph_latency_target_ms / 1000,
+        decrease_factor: float = settings.graph_aimd_decrease_factor,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def _acquire_slot(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def _release_slot(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            # The window may have grown, so wake everyone that can now fit
+            self._condition.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """Hold back new calls for this tenant (e.g. for Graph's Retry-After)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        # Many in-flight calls see the same overload; count it once per latency window
+        if now - self._last_decrease < max(self.latency_target, 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+    def _increase(self) -> None:
+        # +1 per window's worth of successful calls
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def observe(self, status: Optional[int], latency: float) -> None:
+        if status in OVERLOAD_STATUSES or latency > self.latency_target:
+            self._decrease()
+        elif status is not None and status < 500:
+            self._increase()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[_Slot]:
+        await self._acquire_slot()
+        try:
+            await self.bucket.acquire()
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+            slot = _Slot()
+            started = time.monotonic()
+            try:
+                yield slot
+            finally:
+                self.observe(slot.status, time.monotonic() - started)
+        finally:
+            await self._release_slot()
+
+
+class TenantLimiterRegistry:
+    def __init__(self):
+        self._limiters: Dict[str, AdaptiveConcurrencyLimiter] = {}
+
+    def get(self, tenant_id: str) -> AdaptiveConcurrencyLimiter:
+        limiter = self._limiters.get(tenant_id)
+        if limiter is None:
+            limiter = self._limiters[tenant_id] = AdaptiveConcurrencyLimiter()
+        return limiter
+
+    def peek(self, tenant_id: str) -> Optional[AdaptiveConcurrencyLimiter]:
+        return self._limiters.get(tenant_id)
+
+
+tenant_limiters = TenantLimiterRegistry()
@@ -0,0 +1,194 @@
+"""
+Async token provider
+
+Caches client-credential access tokens per (tenant_id, client_id), runs the
+blocking MSAL call in a thread pool so the event loop is never blocked, and
+collapses concurrent requests for the same tenant into one fetch
+(single-flight). Tokens that are still in use, or that were pinned by the
+pre-warmer, are refreshed in the background shortly before they expire.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set, Tuple, TYPE_CHECKING
+from app.config import get_settings
+from app.services.circuit_breaker import circuit_breakers
+
+if TYPE_CHECKING:
+    from app.services.msal_service import MSALService
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+TokenKey = Tuple[str, str]
+
+
+@dataclass
+class CachedToken:
+    access_token: str
+    expires_at: float  # time.monotonic() based
+    acquired_at: float = field(default_factory=time.monotonic)
+    last_used_at: float = field(default_factory=time.monotonic)
+
+    def is_fresh(self, skew: float) -> bool:
+        return time.monotonic() < self.expires_at - skew
+
+
+class TokenProvider:
+    def __init__(
+        self,
+        max_workers: int = settings.token_provider_max_workers,
+        expiry_skew: float = settings.token_expiry_skew_seconds,
+        refresh_ahead: float = settings.token_refresh_ahead_seconds,
+    ):
+        self.expiry_skew = expiry_skew
+        self.refresh_ahead = refresh_ahead
+        self._max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tokens: Dict[TokenKey, CachedToken] = {}
+        self._inflight: Dict[TokenKey, asyncio.Future] = {}
+        self._refresh_tasks: Dict[TokenKey, asyncio.Task] = {}
+        self._services: Dict[TokenKey, "MSALService"] = {}
+        self._pinned: Set[TokenKey] = set()
+
+    @staticmethod
+    def key_for(msal_service: "MSALService") -> TokenKey:
+        return (msal_service.tenant_id, msal_service.client_id)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers,
+                thread_name_prefix="msal-token",
+            )
+        return self._executor
+
+    async def get_token(self, msal_service: "MSALService", force_refresh: bool = False) -> str:
+        """Return a valid access token, fetching it at most once per tenant at a time
+
+        A cached token is served without consulting the circuit breaker (the
+        Graph call using it does); fetching a new one fails fast with
+        CircuitOpenError while the tenant's circuit is open. force_refresh
+        (explicit validation) always goes through and acts as a probe.
+        """
+        key = self.key_for(msal_service)
+        self._services[key] = msal_service
+
+        if not force_refresh:
+            cached = self._tokens.get(key)
+            if cached and cached.is_fresh(self.expiry_skew):
+                cached.last_used_at = time.monotonic()
+                return cached.access_token
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            if force_refresh:
+                # Drop MSAL's in-memory cache so a genuinely new token is issued
+                msal_service.reset_app()
+            inflight = asyncio.ensure_future(self._fetch(key, msal_service, guarded=not force_refresh))
+            self._inflight[key] = inflight
+            inflight.add_done_callback(lambda _f, k=key: self._inflight.pop(k, None))
+
+        # shield: a cancelled caller must not cancel the fetch shared by others
+        token = await asyncio.shield(inflight)
+        return token.access_token
+
+    async def warm(self, msal_service: "MSALService") -> None:
+        """Fetch a token ahead of first use and keep renewing it even while idle"""
+        key = self.key_for(msal_service)
+        self._pinned.add(key)
+        try:
+            await self.get_token(msal_service)
+        except Exception:
+            self._pinned.discard(key)
+            raise
+
+    async def _fetch(self, key: TokenKey, msal_service: "MSALService", guarded: bool = True) -> CachedToken:
+        loop = asyncio.get_running_loop()
+        breaker = circuit_breakers.get(msal_service.tenant_id)
+        # Checked here, where the outcome is always recorded, so a half-open probe is never left claimed
+        if guarded:
+            breaker.check()
+        try:
+            result = await loop.run_in_executor(self.executor, msal_service.acquire_token_result)
+        except Exception as e:
+            breaker.record_failure(e)
+            raise
+        breaker.record_success()
+
+        expires_in = float(result.get("expires_in") or 3600)
+        now = time.monotonic()
+        token = CachedToken(
+            access_token=result["access_token"],
+            expires_at=now + expires_in,
+            acquired_at=now,
+            last_used_at=now,
+        )
+        self._tokens[key] = token
+        self._schedule_refresh(key, token)
+        return token
+
+    def _schedule_refresh(self, key: TokenKey, token: CachedToken) -> None:
+        previous = self._refresh_tasks.pop(key, None)
+        if previous:
+            previous.cancel()
+
+        # MSAL only issues a new token once the cached one has < 5 minutes left,
+        # so refresh_ahead should stay below that window.
+        delay = max(token.expires_at - self.refresh_ahead - time.monotonic(), 30.0)
+        self._refresh_tasks[key] = asyncio.ensure_future(self._refresh_later(key, token, delay))
+
+    async def _refresh_later(self, key: TokenKey, token: CachedToken, delay: float) -> None:
+        try:
+            await asyncio.sleep(delay)
+            # Detach so the fetch below can schedule the next refresh without cancelling us
+            if self._refresh_tasks.get(key) is asyncio.current_task():
+                del self._refresh_tasks[key]
+            if self._tokens.get(key) is not token:
+                return
+            # Only keep refreshing tenants that were pinned or actually used since the last fetch
+            if key not in self._pinned and token.last_used_at <= token.acquired_at:
+                logger.debug(f"Token for tenant {key[0]} idle, not refreshing")
+                return
+            msal_service = self._services.get(key)
+            if msal_service is None or key in self._inflight:
+                return
+            future = asyncio.ensure_future(self._fetch(key, msal_service))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _f, k=key: self._inflight.pop(k, None))
+            await future
+            logger.debug(f"Proactively refreshed token for tenant {key[0]}")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Background token refresh failed for tenant {key[0]}: {e}")
+
+    def invalidate(self, tenant_id: str, client_id: str) -> None:
+        """Forget the cached token (e.g. after the client secret changed)"""
+        key = (tenant_id, client_id)
+        self._tokens.pop(key, None)
+        self._services.pop(key, None)
+        self._pinned.discard(key)
+        task = self._refresh_tasks.pop(key, None)
+        if task:
+            task.cancel()
+
+    async def shutdown(self) -> None:
+        for task in self._refresh_tasks.values():
+            task.cancel()
+        if self._refresh_tasks:
+            await asyncio.gather(*self._refresh_tasks.values(), return_exceptions=True)
+        self._refresh_tasks.clear()
+        self._tokens.clear()
+        self._services.clear()
+        self._pinned.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+token_provider = TokenProvider()
@@ -0,0 +1,102 @@
+"""
+Token pre-warmer
+
+Acquires access tokens for every active tenant right after startup, so the
+first Graph call per tenant does not pay for a client-credentials round trip.
+Warmed tokens are pinned in the token provider, which keeps renewing them
+ahead of expiry.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import select
+from app.config import get_settings
+from app.database import AsyncSessionLocal
+from app.models import Tenant
+from app.services.tenant_registry import tenant_registry
+from app.services.token_provider import token_provider
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class TokenWarmer:
+    def __init__(self):
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.total = 0
+        self.warmed = 0
+        self.failed: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def _warm_tenant(self, tenant: Tenant, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            try:
+                msal_service = tenant_registry.get_msal_service(tenant)
+                await asyncio.wait_for(token_provider.warm(msal_service), settings.token_prewarm_timeout)
+                self.warmed += 1
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                self.failed.append({"tenant_id": tenant.id, "tenant_name": tenant.tenant_name, "error": error[:500]})
+                logger.warning(f"Token pre-warm failed for tenant {tenant.id}: {error}")
+
+    async def warm_all(self) -> Dict[str, Any]:
+        """Acquire tokens for all active tenants concurrently within TOKEN_PREWARM_CONCURRENCY"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Tenant).where(Tenant.is_active == True))
+            tenants = result.scalars().all()
+
+        self.started_at = datetime.utcnow()
+        self.finished_at = None
+        self.total = len(tenants)
+        self.warmed = 0
+        self.failed = []
+
+        semaphore = asyncio.Semaphore(max(1, settings.token_prewarm_concurrency))
+        await asyncio.gather(*(self._warm_tenant(tenant, semaphore) for tenant in tenants))
+
+        self.finished_at = datetime.utcnow()
+        elapsed = (self.finished_at - self.started_at).total_seconds()
+        logger.info(
+            f"Token pre-warm: {self.warmed}/{self.total} tenants warmed in {elapsed:.1f}s, "
+            f"{len(self.failed)} failed"
+        )
+        return self.status()
+
+    def start(self) -> asyncio.Task:
+        """Run warm_all in the background (startup must not wait for every tenant)
+
+        Every run goes through this tracked task, so runs never overlap; while one
+        is in progress its task is returned.
+        """
+        if not self.running:
+            self._task = asyncio.create_task(self.warm_all(), name="token-prewarm")
+        return self._task
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "total": self.total,
+            "warmed": self.warmed,
+            "failed": list(self.failed),
+        }
+
+
+token_warmer = TokenWarmer()
@@ -0,0 +1,69 @@
+"""
+Cross-tenant user search
+
+Fans a user search out to many tenants at once. Each tenant gets its own
+timeout, matches are yielded as soon as any tenant answers, and outstanding
+searches are cancelled once the caller has enough results.
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+from app.config import get_settings
+from app.models import Tenant
+from app.services.tenant_registry import tenant_registry
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+async def _search_tenant(
+    tenant: Tenant,
+    keyword: str,
+    select: Optional[List[str]],
+    top: int,
+    timeout: float
+) -> Dict[str, Any]:
+    try:
+        graph_service = tenant_registry.get_graph_service(tenant)
+        users = await asyncio.wait_for(graph_service.search_users(keyword, select=select, top=top), timeout)
+        return {"tenant": tenant, "users": users, "error": None}
+    except asyncio.TimeoutError:
+        return {"tenant": tenant, "users": [], "error": f"搜索超时 ({timeout:.0f}s)"}
+    except Exception as e:
+        logger.warning(f"User search failed for tenant {tenant.id}: {e}")
+        return {"tenant": tenant, "users": [], "error": str(e)}
+
+
+async def iter_user_search(
+    tenants: Iterable[Tenant],
+    keyword: str,
+    select: Optional[List[str]] = None,
+    limit: int = 50,
+    timeout: float = settings.user_search_tenant_timeout
+) -> AsyncIterator[Dict[str, Any]]:
+    """Search every tenant concurrently, yielding per-tenant results as they complete
+
+    Each yielded item is {"tenant", "users", "error"}; "users" is trimmed so
+    that no more than `limit` users are yielded in total. Stops (and cancels
+    the remaining searches) once `limit` is reached or the consumer stops.
+    """
+    semaphore = asyncio.Semaphore(max(1, settings.user_search_concurrency))
+
+    async def run(tenant: Tenant) -> Dict[str, Any]:
+        async with semaphore:
+            return await _search_tenant(tenant, keyword, select, limit, timeout)
+
+    tasks = [asyncio.create_task(run(tenant)) for tenant in tenants]
+    remaining = limit
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            result["users"] = result["users"][:remaining]
+            remaining -= len(result["users"])
+            yield result
+            if remaining <= 0:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -1,26 +1,38 @@
 import { useQuery } from '@tanstack/react-query'
-import { licenseApi } from '@/utils/api'
+import { licenseApi, type License } from '@/utils/api'
 import { getLicenseName, formatLicenseUsage, formatDate } from '@/utils/utils'
-import { Award, Loader2, Clock } from 'lucide-react'
+import { Award, Loader2, Clock, AlertCircle, RefreshCw } from 'lucide-react'
 
 interface TenantLicensesSummaryProps {
   tenantId: number
   compact?: boolean
+  // Preloaded by the parent (bulk endpoint): null while it is loading, undefined to fetch here
+  licenses?: License[] | null
+  // Set by the parent when the bulk entry (or the bulk request) failed
+  error?: string | null
+  // Cached data past its TTL that the server is revalidating in the background
+  stale?: boolean
 }
 
-export function TenantLicensesSummary({ tenantId, compact = false }: TenantLicensesSummaryProps) {
-  const { data: licenses, isLoading, error } = useQuery({
+export function TenantLicensesSummary({
+  tenantId,
+  compact = false,
+  licenses: preloaded,
+  error: preloadedError,
+  stale = false,
+}: TenantLicensesSummaryProps) {
+  const { data: fetched, isLoading: isFetching, error: fetchError } = useQuery({
     queryKey: ['licenses', tenantId],
     queryFn: async () => {
-      try {
-        const res = await licenseApi.listByTenant(tenantId)
-        return res.data
-      } catch {
-        return []
-      }
+      const res = await licenseApi.listByTenant(tenantId)
+      return res.data
     },
     retry: false,
+    enabled: preloaded === undefined,
   })
+  const licenses = preloaded ?? fetched
+  const isLoading = preloaded === null || (preloaded === undefined && isFetching)
+  const error = preloadedError ?? (preloaded === undefined ? fetchError?.message : null)
 
   if (isLoading) {
     return (
@@ -30,7 +42,19 @@ export function TenantLicensesSummary({ tenantId, compact = false }: TenantLicen
     )
   }
 
-  if (error || !licenses || licenses.length === 0) {
+  if (error) {
+    return (
+      <div
+        className={`flex items-start gap-1 py-3 text-red-600 ${compact ? 'text-[10px]' : 'text-xs'}`}
+        title={error}
+      >
+        <AlertCircle className={`shrink-0 mt-0.5 ${compact ? 'h-2.5 w-2.5' : 'h-3 w-3'}`} />
+        <span className="line-clamp-2">获取许可证失败: {error}</span>
+      </div>
+    )
+  }
+
+  if (!licenses || licenses.length === 0) {
     return (
       <div className="text-center py-3 text-xs text-muted-foreground">
         暂无许可证数据
@@ -50,7 +74,14 @@ export function TenantLicensesSummary({ tenantId, compact = false }: TenantLicen
             <Award className="h-2.5 w-2.5 mr-1" />
             许可证
           </span>
-          <span className="font-medium">{licenses.length} 种</span>
+          <span className="flex items-center gap-1 font-medium">
+            {stale && (
+              <span title="缓存已过期，正在后台刷新">
+                <RefreshCw className="h-2.5 w-2.5 animate-spin text-yellow-600" />
+              </span>
+            )}
+            {licenses.length} 种
+          </span>
         </div>
         <div className="flex items-center justify-between text-[10px]">
           <span className="text-muted-foreground">分配</span>
@@ -133,7 +164,13 @@ export function TenantLicensesSummary({ tenantId, compact = false }: TenantLicen
           <Award className="h-4 w-4 text-blue-600" />
           <span className="text-sm font-medium">许可证概览</span>
         </div>
-        <span className="text-xs text-muted-foreground">
+        <span className="flex items-center gap-2 text-xs text-muted-foreground">
+          {stale && (
+            <span className="inline-flex items-center gap-1 text-yellow-600" title="缓存已过期，正在后台刷新">
+              <RefreshCw className="h-3 w-3 animate-spin" />
+              刷新中
+            </span>
+          )}
           共 {licenses.length} 种许可证
         </span>
       </div>
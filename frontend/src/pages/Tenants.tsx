@@ -63,6 +63,30 @@ export function Tenants() {
     },
   })
 
+  // 一次请求获取所有租户的许可证概览，避免每行单独请求
+  const { data: licenseSummaries, isLoading: isLicensesLoading, error: licensesError } = useQuery({
+    queryKey: ['licenses', 'tenants'],
+    queryFn: async () => {
+      const res = await licenseApi.listAllTenants()
+      return Object.fromEntries(res.data.map((summary) => [summary.tenant_id, summary]))
+    },
+    enabled: !!tenants && tenants.items.length > 0,
+    // 有过期缓存时服务端正在后台刷新，稍后重新获取以显示新数据
+    refetchInterval: (query) =>
+      Object.values(query.state.data ?? {}).some((summary) => summary.stale) ? 15000 : false,
+  })
+
+  const getTenantLicenses = (tenantId: number) => {
+    if (isLicensesLoading) return { licenses: null }
+    if (licensesError) return { licenses: [], error: licensesError.message }
+    const summary = licenseSummaries?.[tenantId]
+    return {
+      licenses: summary?.licenses ?? [],
+      error: summary?.source === 'error' ? summary.error || '未知错误' : null,
+      stale: summary?.stale ?? false,
+    }
+  }
+
   const createMutation = useMutation({
     mutationFn: (data: TenantCreate) => tenantApi.create(data),
     onSuccess: () => {
@@ -176,6 +200,7 @@ export function Tenants() {
       return licenseApi.listByTenant(tenantId, true)
     },
     onSuccess: () => {
+      queryClient.invalidateQueries({ queryKey: ['licenses', 'tenants'] })
       toast.success('许可证数据已刷新')
       setLoadingTenantIds(prev => ({ ...prev, refreshLicenses: undefined }))
     },
@@ -620,7 +645,7 @@ export function Tenants() {
 
                             {/* 许可证摘要 */}
                             <div className="pt-2 border-t">
-                              <TenantLicensesSummary tenantId={tenant.id} compact />
+                              <TenantLicensesSummary tenantId={tenant.id} {...getTenantLicenses(tenant.id)} compact />
                             </div>
                           </div>
                         )}
@@ -843,7 +868,7 @@ export function Tenants() {
                       </div>
                     </div>
                     <div className="pt-3 border-t">
-                      <TenantLicensesSummary tenantId={tenant.id} compact />
+                      <TenantLicensesSummary tenantId={tenant.id} {...getTenantLicenses(tenant.id)} compact />
                     </div>
                   </CardContent>
                 </Card>
@@ -98,6 +98,19 @@ export interface License {
   expires_at?: string
 }
 
+export interface TenantLicenseSummary {
+  tenant_id: number
+  tenant_name?: string
+  source: 'cache' | 'graph' | 'error'
+  cached_at?: string
+  total_enabled: number
+  total_consumed: number
+  licenses: License[]
+  // Served from an expired cache while the server refreshes it in the background
+  stale?: boolean
+  error?: string
+}
+
 export interface Domain {
   id: string
   authentication_type: string
@@ -181,6 +194,8 @@ export const licenseApi = {
   list: () => api.get<License[]>('/o365/licenses'),
   listByTenant: (tenantId: number, refresh?: boolean) => 
     api.get<License[]>(`/o365/licenses/tenant/${tenantId}`, { params: { refresh } }),
+  listAllTenants: (refresh?: boolean) =>
+    api.get<TenantLicenseSummary[]>('/o365/licenses/tenants', { params: { refresh } }),
 }
 
 // Domain APIs